@@ -0,0 +1,18 @@
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', 1))
+
+# Free play games live in the worker that created them unless FREE_PLAY_STORE=sql, so a second worker would
+# answer guesses for games it has never seen
+if workers > 1 and os.getenv('FREE_PLAY_STORE', 'memory') != 'sql':
+    raise RuntimeError(f"WEB_CONCURRENCY={workers} needs FREE_PLAY_STORE=sql; the in-memory free play store is "
+                       "per worker")
+
+# Threaded workers: a Legendary Lines stream holds one thread, mostly asleep waiting on the model, instead of a
+# whole sync worker. Keep threads above LL_MAX_STREAMS so the daily pages always have threads left.
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 128))
+
+# With gthread this is the worker heartbeat, not a per-request limit, so long streams are fine
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
@@ -0,0 +1,428 @@
+import hashlib
+import json
+import os
+import queue
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+
+from prompt_context import estimate_tokens
+
+
+class LLMError(Exception):
+    pass
+
+
+class ResourceExhausted(LLMError):
+    """The provider is out of quota (HTTP 429)"""
+
+
+class DeadlineExceeded(LLMError):
+    """A call took too long to start or to finish"""
+
+
+class CircuitOpen(LLMError):
+    """The provider's circuit breaker is open, so the call was not made"""
+
+
+class CircuitBreaker:
+    """Stops calling a provider that keeps failing. After `failure_threshold` failures in a row the breaker
+    opens and calls fail fast with CircuitOpen. After `reset_seconds` one trial call is let through (half open);
+    its outcome closes the breaker or opens it again"""
+    def __init__(self, failure_threshold=5, reset_seconds=30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = 0
+        self.opens = 0
+        self.rejected = 0
+        self.trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go ahead; a half-open breaker allows one at a time"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self.trial:
+                self.trial = True
+                return True
+            self.rejected += 1
+            return False
+
+    def is_open(self):
+        """Whether a call made now would be rejected. Unlike allow(), this never starts a trial"""
+        with self._lock:
+            if self.state == 'open':
+                return time.monotonic() - self.opened_at < self.reset_seconds
+            return self.state == 'half_open' and self.trial
+
+    def retry_in(self):
+        """Seconds until the next trial call is allowed"""
+        with self._lock:
+            if self.state != 'open':
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_seconds - time.monotonic())
+
+    def record(self, succeeded):
+        """A finished call's outcome: True, False, or None for a call abandoned before it showed either"""
+        with self._lock:
+            self.trial = False
+            if succeeded is None:
+                return
+            if succeeded:
+                self.state = 'closed'
+                self.consecutive_failures = 0
+                return
+            self.consecutive_failures += 1
+            if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.opens += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'failure_threshold': self.failure_threshold,
+                'opens': self.opens,
+                'rejected': self.rejected,
+                'retry_in_seconds': (round(max(0.0, self.opened_at + self.reset_seconds - time.monotonic()), 1)
+                                     if self.state == 'open' else 0.0),
+            }
+
+
+class CallMetrics:
+    """Timings and size of one streamed call"""
+    def __init__(self, provider, prompt_tokens=None):
+        self.provider = provider
+        self.prompt_tokens = prompt_tokens
+        self.started = time.perf_counter()
+        self.first_chunk_ms = None
+        self.total_ms = None
+        self.chunks = 0
+        self.output_chars = 0
+        self.error = None
+
+    def chunk(self, text):
+        if self.first_chunk_ms is None:
+            self.first_chunk_ms = (time.perf_counter() - self.started) * 1000
+        self.chunks += 1
+        self.output_chars += len(text)
+
+    def finish(self, error=None):
+        self.total_ms = (time.perf_counter() - self.started) * 1000
+        self.error = error
+
+    def to_dict(self):
+        return {
+            'provider': self.provider,
+            'prompt_tokens': self.prompt_tokens,
+            'first_chunk_ms': round(self.first_chunk_ms, 1) if self.first_chunk_ms is not None else None,
+            'total_ms': round(self.total_ms, 1) if self.total_ms is not None else None,
+            'chunks': self.chunks,
+            'output_chars': self.output_chars,
+            'error': self.error,
+        }
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * q))], 1)
+
+
+class Provider(ABC):
+    """Streams text for a (system instruction, prompt) pair. Subclasses implement _stream; stream() wraps it
+    with per-call metrics, the first-chunk and total deadlines, and the circuit breaker"""
+    name = 'provider'
+
+    def __init__(self, window=200, first_chunk_timeout=None, total_timeout=None, breaker=None):
+        self.first_chunk_timeout = first_chunk_timeout
+        self.total_timeout = total_timeout
+        self.breaker = breaker
+        self.calls = deque(maxlen=window)
+        self.total_calls = 0
+        self.failed_calls = 0
+        self.deadlines_exceeded = 0
+        self._lock = threading.Lock()
+
+    def circuit_open(self):
+        return self.breaker is not None and self.breaker.is_open()
+
+    def stream(self, system, prompt):
+        if self.breaker is not None and not self.breaker.allow():
+            raise CircuitOpen(f"{self.name} circuit breaker is open")
+
+        metrics = CallMetrics(self.name, prompt_tokens=estimate_tokens(system) + estimate_tokens(prompt))
+        error = None
+        succeeded = None
+        try:
+            chunks = self._stream(system, prompt)
+            if self.first_chunk_timeout or self.total_timeout:
+                chunks = self._with_deadlines(chunks)
+            for text in chunks:
+                if text:
+                    metrics.chunk(text)
+                    yield text
+            succeeded = True
+        except GeneratorExit:
+            # Stopped by the consumer: the call worked if it got as far as producing text
+            succeeded = metrics.chunks > 0 or None
+            raise
+        except Exception as err:
+            error = type(err).__name__
+            succeeded = False
+            raise
+        finally:
+            # A consumer that stops early (GeneratorExit) still gets its call recorded
+            metrics.finish(error)
+            if self.breaker is not None:
+                self.breaker.record(succeeded)
+            with self._lock:
+                self.calls.append(metrics)
+                self.total_calls += 1
+                self.failed_calls += error is not None
+                self.deadlines_exceeded += error == DeadlineExceeded.__name__
+
+    def _with_deadlines(self, chunks):
+        """Pulls the provider's stream on its own thread, so a call stuck inside a blocking read still times
+        out. The abandoned thread stops at its next chunk"""
+        results = queue.Queue()
+        stop = threading.Event()
+
+        def pump():
+            try:
+                for text in chunks:
+                    if stop.is_set():
+                        break
+                    results.put(('text', text))
+                results.put(('end', None))
+            except Exception as err:
+                results.put(('error', err))
+            finally:
+                chunks.close()
+
+        threading.Thread(target=pump, name=f"llm-{self.name}", daemon=True).start()
+        started = time.monotonic()
+        first = True
+        try:
+            while True:
+                elapsed = time.monotonic() - started
+                limits = []
+                if first and self.first_chunk_timeout:
+                    limits.append((self.first_chunk_timeout, 'no first chunk'))
+                if self.total_timeout:
+                    limits.append((self.total_timeout, 'response incomplete'))
+                limit, what = min(limits) if limits else (None, None)
+                try:
+                    kind, value = results.get(timeout=max(0.0, limit - elapsed) if limit else None)
+                except queue.Empty:
+                    raise DeadlineExceeded(f"{self.name}: {what} after {limit}s") from None
+                if kind == 'end':
+                    return
+                if kind == 'error':
+                    raise value
+                first = first and not value
+                yield value
+        finally:
+            stop.set()
+
+    @abstractmethod
+    def _stream(self, system, prompt):
+        """Yields the response text in chunks as the backend produces them"""
+
+    def stats(self):
+        with self._lock:
+            calls = list(self.calls)
+            total_calls, failed_calls, deadlines_exceeded = self.total_calls, self.failed_calls, self.deadlines_exceeded
+        first_chunk = [call.first_chunk_ms for call in calls if call.first_chunk_ms is not None]
+        total = [call.total_ms for call in calls]
+        return {
+            'provider': self.name,
+            'calls': total_calls,
+            'failed_calls': failed_calls,
+            'deadlines_exceeded': deadlines_exceeded,
+            'first_chunk_timeout': self.first_chunk_timeout,
+            'total_timeout': self.total_timeout,
+            'breaker': self.breaker.stats() if self.breaker is not None else None,
+            'first_chunk_ms_p50': _percentile(first_chunk, 0.5),
+            'first_chunk_ms_p95': _percentile(first_chunk, 0.95),
+            'total_ms_p50': _percentile(total, 0.5),
+            'total_ms_p95': _percentile(total, 0.95),
+            'mean_prompt_tokens': round(sum(call.prompt_tokens for call in calls) / len(calls), 1) if calls else None,
+            'max_prompt_tokens': max((call.prompt_tokens for call in calls), default=None),
+            'mean_chunks': round(sum(call.chunks for call in calls) / len(calls), 1) if calls else None,
+            'mean_output_chars': round(sum(call.output_chars for call in calls) / len(calls), 1) if calls else None,
+            'recent_calls': [call.to_dict() for call in calls[-10:]],
+        }
+
+
+class GeminiProvider(Provider):
+    name = 'gemini'
+
+    def __init__(self, api_key=None, model="gemini-flash-lite-latest", thinking_budget=0, **kwargs):
+        super().__init__(**kwargs)
+        self.api_key = api_key
+        self.model = model
+        self.thinking_budget = thinking_budget
+        self._client = None
+
+    def client(self):
+        if self._client is None:
+            from google import genai
+            self._client = genai.Client(api_key=self.api_key)
+        return self._client
+
+    def _stream(self, system, prompt):
+        from google.genai import types
+
+        contents = [types.Content(role="user", parts=[types.Part.from_text(text=prompt)])]
+        config = types.GenerateContentConfig(
+            thinking_config=types.ThinkingConfig(thinking_budget=self.thinking_budget),
+            system_instruction=[types.Part.from_text(text=system)],
+        )
+        try:
+            for chunk in self.client().models.generate_content_stream(model=self.model, contents=contents,
+                                                                      config=config):
+                yield chunk.text or ''
+        except Exception as err:
+            if getattr(err, 'code', None) == 429 or type(err).__name__ == 'ResourceExhausted':
+                raise ResourceExhausted(str(err)) from err
+            raise
+
+
+STUB_SENTENCES = (
+    "This route follows a clean line up a steep face with good friction.",
+    "The crux comes low, where a thin crack pinches down before opening into jugs.",
+    "Gear is plentiful in the upper half, though the start feels committing.",
+    "Expect a short approach and a shady belay for most of the day.",
+    "Climbers often mention the exposure near the top as the highlight.",
+    "A ledge halfway up makes for a comfortable rest before the final moves.",
+    "The rock is solid and featured, rewarding careful footwork.",
+)
+
+
+class StubProvider(Provider):
+    """Deterministic canned text for offline runs and load tests. The same prompt always produces the same
+    text, streamed a few words at a time with configurable delays. `failure_rate` makes that share of calls
+    fail, with ResourceExhausted when `exhausted` is set, and a long first_chunk_delay stands in for a stalled
+    backend, for exercising the deadlines and the circuit breaker"""
+    name = 'stub'
+
+    def __init__(self, first_chunk_delay=0.3, chunk_delay=0.05, words_per_chunk=3, sentences=4, failure_rate=0.0,
+                 exhausted=False, seed=None, **kwargs):
+        super().__init__(**kwargs)
+        self.first_chunk_delay = first_chunk_delay
+        self.chunk_delay = chunk_delay
+        self.words_per_chunk = words_per_chunk
+        self.sentences = sentences
+        self.failure_rate = failure_rate
+        self.exhausted = exhausted
+        self.random = random.Random(seed)
+
+    def text_for(self, system, prompt):
+        seed = int(hashlib.sha256(f"{system}\n{prompt}".encode()).hexdigest(), 16)
+        # len(STUB_SENTENCES) is prime, so any step walks through distinct sentences
+        n = len(STUB_SENTENCES)
+        step = 1 + (seed >> 8) % (n - 1)
+        picked = [STUB_SENTENCES[(seed + i * step) % n] for i in range(min(self.sentences, n))]
+        return ' '.join(picked)
+
+    def _stream(self, system, prompt):
+        words = self.text_for(system, prompt).split(' ')
+        time.sleep(self.first_chunk_delay)
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            raise (ResourceExhausted if self.exhausted else LLMError)("Stub failure")
+        for i in range(0, len(words), self.words_per_chunk):
+            if i:
+                time.sleep(self.chunk_delay)
+            yield ' '.join(words[i:i + self.words_per_chunk]) + (' ' if i + self.words_per_chunk < len(words) else '')
+
+
+class RecordReplayProvider(Provider):
+    """Records another provider's streams to a JSON-lines file, or replays them from it. Replay keeps each
+    chunk's recorded offset when `realtime` is set, so a load test sees the real model's pacing without
+    calling it"""
+
+    def __init__(self, path, inner=None, realtime=True, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.inner = inner
+        self.realtime = realtime
+        self.name = f"record:{inner.name}" if inner is not None else 'replay'
+        self.recordings = {}
+        self._file_lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.recordings[entry['key']] = entry['chunks']
+
+    @staticmethod
+    def key(system, prompt):
+        return hashlib.sha256(f"{system}\n{prompt}".encode()).hexdigest()
+
+    def _stream(self, system, prompt):
+        key = self.key(system, prompt)
+        if self.inner is None:
+            yield from self._replay(key)
+        else:
+            yield from self._record(key, system, prompt)
+
+    def _replay(self, key):
+        chunks = self.recordings.get(key)
+        if chunks is None:
+            raise LLMError(f"No recording for prompt {key[:12]}")
+        started = time.perf_counter()
+        for offset_ms, text in chunks:
+            if self.realtime:
+                time.sleep(max(0.0, offset_ms / 1000 - (time.perf_counter() - started)))
+            yield text
+
+    def _record(self, key, system, prompt):
+        started = time.perf_counter()
+        chunks = []
+        for text in self.inner.stream(system, prompt):
+            chunks.append([round((time.perf_counter() - started) * 1000, 1), text])
+            yield text
+        self.recordings[key] = chunks
+        with self._file_lock, open(self.path, 'a') as f:
+            f.write(json.dumps({'key': key, 'chunks': chunks}) + '\n')
+
+
+def provider_from_env():
+    """LLM_PROVIDER picks the backend: gemini (default), stub, record (gemini, saved to LLM_RECORDINGS) or
+    replay (from LLM_RECORDINGS). Deadlines and the circuit breaker apply to whichever is picked; 0 turns a
+    deadline off"""
+    name = os.getenv('LLM_PROVIDER', 'gemini')
+    options = {
+        'first_chunk_timeout': float(os.getenv('LLM_FIRST_CHUNK_TIMEOUT_SECONDS', 10)) or None,
+        'total_timeout': float(os.getenv('LLM_TOTAL_TIMEOUT_SECONDS', 60)) or None,
+        'breaker': CircuitBreaker(failure_threshold=int(os.getenv('LLM_BREAKER_FAILURES', 5)),
+                                  reset_seconds=int(os.getenv('LLM_BREAKER_RESET_SECONDS', 30))),
+    }
+    if name == 'stub':
+        return StubProvider(first_chunk_delay=int(os.getenv('LLM_STUB_FIRST_CHUNK_MS', 300)) / 1000,
+                            chunk_delay=int(os.getenv('LLM_STUB_CHUNK_MS', 50)) / 1000,
+                            failure_rate=float(os.getenv('LLM_STUB_FAILURE_RATE', 0)),
+                            exhausted=os.getenv('LLM_STUB_EXHAUSTED', '0') == '1',
+                            **options)
+    api_key, model = os.getenv('GEMINI_API_KEY'), os.getenv('GEMINI_MODEL', "gemini-flash-lite-latest")
+    recordings = os.getenv('LLM_RECORDINGS', 'llm_recordings.jsonl')
+    if name == 'record':
+        return RecordReplayProvider(recordings, inner=GeminiProvider(api_key=api_key, model=model), **options)
+    if name == 'replay':
+        return RecordReplayProvider(recordings, realtime=os.getenv('LLM_REPLAY_REALTIME', '1') == '1', **options)
+    if name != 'gemini':
+        raise ValueError(f"Unknown LLM_PROVIDER {name!r}")
+    return GeminiProvider(api_key=api_key, model=model, **options)
@@ -0,0 +1,94 @@
+import re
+
+# Character budgets keep every prompt under roughly 1k tokens, whatever the route's page looked like
+DESCRIPTION_BUDGET_CHARS = 1500
+COMMENT_BUDGET_CHARS = 1200
+MAX_COMMENT_CHARS = 400
+MIN_COMMENT_CHARS = 25
+
+# Words that make a comment useful for telling routes apart
+DESCRIPTIVE_WORDS = {
+    'arete', 'bolt', 'bolts', 'boulder', 'chimney', 'corner', 'crack', 'crimp', 'crimps', 'crux', 'dihedral',
+    'edge', 'edges', 'face', 'finger', 'fingers', 'fist', 'flake', 'gear', 'hand', 'hands', 'jam', 'jug', 'jugs',
+    'layback', 'ledge', 'mantle', 'offwidth', 'overhang', 'pitch', 'pockets', 'roof', 'runout', 'slab', 'slopers',
+    'squeeze', 'stem', 'steep', 'traverse', 'undercling',
+}
+
+
+def estimate_tokens(text):
+    """Rough token count, about four characters a token for English prose"""
+    return (len(text) + 3) // 4
+
+
+def normalize_text(text):
+    """Whitespace collapsed and stray markup removed"""
+    text = re.sub(r'<[^>]+>', ' ', text or '')
+    text = text.replace('&nbsp;', ' ').replace('&amp;', '&')
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def truncate(text, limit):
+    """At most `limit` characters, cut at the last sentence end (or word) that fits"""
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    end = max(cut.rfind('. '), cut.rfind('! '), cut.rfind('? '))
+    if end > limit // 2:
+        return cut[:end + 1]
+    return cut.rsplit(' ', 1)[0] + '...'
+
+
+def comment_key(text):
+    return ' '.join(re.findall(r'[a-z0-9]+', text.lower()))
+
+
+def rank_comment(text):
+    words = re.findall(r'[a-z]+', text.lower())
+    descriptive = len({word for word in words if word in DESCRIPTIVE_WORDS})
+    return descriptive * 2 + min(len(text), MAX_COMMENT_CHARS) / 100
+
+
+def digest_comments(comments):
+    """Deduplicated comments, most descriptive first, within COMMENT_BUDGET_CHARS. Returns (digest, used)"""
+    unique = {}
+    for text in comments:
+        text = normalize_text(text)
+        key = comment_key(text)
+        if len(text) < MIN_COMMENT_CHARS or key in unique:
+            continue
+        unique[key] = text
+    # A comment wholly repeated inside a longer one adds nothing
+    keys = sorted(unique, key=len, reverse=True)
+    kept = [key for i, key in enumerate(keys) if not any(key in longer for longer in keys[:i])]
+
+    digest, used = [], 0
+    for key in sorted(kept, key=lambda key: (-rank_comment(unique[key]), key)):
+        text = truncate(unique[key], MAX_COMMENT_CHARS)
+        if used + len(text) > COMMENT_BUDGET_CHARS:
+            continue
+        digest.append(text)
+        used += len(text) + 1
+    return ' '.join(digest), len(digest)
+
+
+def build_prompt(route_name, grade, length, crag, sub_area, main_area, description, comment_digest):
+    area = f", in {main_area}" if main_area else ""
+    return (f"The Route is {route_name}, {grade}, {length}ft long, at the crag {crag} in sub area of {sub_area}{area}. "
+            f"Description: {description}. User comments: {comment_digest}.")
+
+
+def build_context(description_row, comments, main_area=None):
+    """Fields for a route_prompt_contexts row from an mp_descriptions row, the route's comment texts and the
+    name of the climbing area it belongs to"""
+    description = truncate(normalize_text(description_row.description), DESCRIPTION_BUDGET_CHARS)
+    digest, comments_used = digest_comments(comments)
+    prompt = build_prompt(description_row.route_name, description_row.grade, description_row.length,
+                          description_row.crag, description_row.main_area, main_area, description, digest)
+    return {
+        'route_id': description_row.route_id,
+        'description': description,
+        'comment_digest': digest,
+        'comments_used': comments_used,
+        'prompt': prompt,
+        'prompt_tokens': estimate_tokens(prompt),
+    }
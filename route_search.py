@@ -0,0 +1,78 @@
+import re
+import unicodedata
+
+import numpy as np
+
+# Fields searched and how much a match on each counts. A route name match beats the same match on its crag
+FIELDS = (('route_name', 1.0), ('crag', 0.6), ('main_area', 0.4))
+MIN_SCORE = 0.2
+PREFIX_BONUS = 0.5
+WORD_PREFIX_BONUS = 0.25
+
+
+def normalize(text):
+    """Lowercase ASCII words: accents folded, punctuation dropped"""
+    text = unicodedata.normalize('NFKD', str(text or '')).encode('ascii', 'ignore').decode().lower()
+    return ' '.join(re.findall(r'[a-z0-9]+', text))
+
+
+def trigrams(text):
+    """Trigrams of each word padded as '  word ', so one and two letter queries still match word starts"""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """Typo-tolerant search over a list of route dicts. Every route scores the Dice overlap between the query's
+    trigrams and each field's, weighted per field, keeping its best field; names that start with the query, or
+    have a word that does, get a bonus on top"""
+    def __init__(self, rows):
+        self.rows = rows
+        self.by_route_id = {row['route_id']: row for row in rows}
+        self.names = [normalize(row['route_name']) for row in rows]
+        self.weights = np.array([weight for _, weight in FIELDS])
+
+        postings = {}
+        self.gram_counts = np.zeros((len(rows), len(FIELDS)))
+        for i, row in enumerate(rows):
+            for f, (field, _) in enumerate(FIELDS):
+                grams = trigrams(normalize(row.get(field)))
+                self.gram_counts[i, f] = len(grams)
+                for gram in grams:
+                    postings.setdefault(gram, []).append(i * len(FIELDS) + f)
+        # Each posting is a flat (route, field) cell number, so a query is one bincount
+        self.postings = {gram: np.array(cells, dtype=np.int32) for gram, cells in postings.items()}
+
+    def search(self, query, limit=10):
+        query = normalize(query)
+        grams = trigrams(query)
+        hits = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not hits:
+            return []
+
+        # Only the (route, field) cells a query gram touched are scored; cells come out sorted, grouped by route
+        cells, overlap = np.unique(np.concatenate(hits), return_counts=True)
+        dice = 2 * overlap / (len(grams) + self.gram_counts.ravel()[cells]) * self.weights[cells % len(FIELDS)]
+        routes = cells // len(FIELDS)
+        starts = np.flatnonzero(np.r_[True, routes[1:] != routes[:-1]])
+        candidates, scores = routes[starts], np.maximum.reduceat(dice, starts)
+
+        # Prefix bonuses can lift a candidate a long way, so look a few pages past the limit before applying them
+        if len(candidates) > limit * 5:
+            keep = np.sort(np.argpartition(-scores, limit * 5)[:limit * 5])
+            candidates, scores = candidates[keep], scores[keep]
+        for j, i in enumerate(candidates):
+            name = self.names[i]
+            if name.startswith(query):
+                scores[j] += PREFIX_BONUS
+            elif f" {query}" in f" {name}":
+                scores[j] += WORD_PREFIX_BONUS
+
+        order = np.argsort(-scores, kind='stable')[:limit]
+        return [self.rows[candidates[j]] for j in order if scores[j] >= MIN_SCORE]
+
+    def get(self, route_id):
+        return self.by_route_id.get(route_id)
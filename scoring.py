@@ -0,0 +1,107 @@
+import numpy as np
+
+# WGS-84, the ellipsoid geopy's geodesic uses by default
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+# Mean earth radius. Haversine with this radius is within 0.57% of the WGS-84 geodesic
+# for any pair of points (worst case, 0.5614%, along short meridian arcs at the equator)
+EARTH_RADIUS_KM = 6371.0088
+
+MAX_SCORE = 5000
+DAILY_SCALE = 300
+DAILY_SNAP = 4992
+FREE_PLAY_SCALE = 30
+FREE_PLAY_SNAP = 4990
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=np.float64)) for x in (lat1, lon1, lat2, lon2))
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+
+def vincenty_km(lat1, lon1, lat2, lon2, max_iter=100, tol=1e-12):
+    """Vincenty's inverse formula on WGS-84, vectorized. Agrees with geopy's geodesic to well under a metre;
+    the few nearly antipodal pairs that don't converge are solved with geographiclib instead"""
+    lat1_deg, lon1_deg, lat2_deg, lon2_deg = np.broadcast_arrays(
+        *(np.asarray(x, dtype=np.float64) for x in (lat1, lon1, lat2, lon2)))
+    lat1, lon1, lat2, lon2 = (np.radians(x) for x in (lat1_deg, lon1_deg, lat2_deg, lon2_deg))
+
+    f = WGS84_F
+    L = lon2 - lon1
+    U1 = np.arctan((1 - f) * np.tan(lat1))
+    U2 = np.arctan((1 - f) * np.tan(lat2))
+    sin_U1, cos_U1 = np.sin(U1), np.cos(U1)
+    sin_U2, cos_U2 = np.sin(U2), np.cos(U2)
+
+    lam = L.copy()
+    sin_sigma, cos_sigma, sigma = np.empty_like(L), np.empty_like(L), np.empty_like(L)
+    cos2_alpha, cos_2sm = np.empty_like(L), np.empty_like(L)
+    # Only pairs that haven't converged yet are iterated, most settle within a handful of steps
+    active = np.arange(L.size)
+    flat = [x.reshape(-1) for x in (L, lam, sin_U1, cos_U1, sin_U2, cos_U2,
+                                     sin_sigma, cos_sigma, sigma, cos2_alpha, cos_2sm)]
+    L_f, lam_f, sin_U1_f, cos_U1_f, sin_U2_f, cos_U2_f, sin_sigma_f, cos_sigma_f, sigma_f, cos2_alpha_f, cos_2sm_f = flat
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(max_iter):
+            l, s1, c1, s2, c2 = lam_f[active], sin_U1_f[active], cos_U1_f[active], sin_U2_f[active], cos_U2_f[active]
+            sin_lam, cos_lam = np.sin(l), np.cos(l)
+            ss = np.sqrt((c2 * sin_lam) ** 2 + (c1 * s2 - s1 * c2 * cos_lam) ** 2)
+            cs = s1 * s2 + c1 * c2 * cos_lam
+            sg = np.arctan2(ss, cs)
+            sin_alpha = np.where(ss == 0, 0.0, c1 * c2 * sin_lam / ss)
+            c2a = 1 - sin_alpha ** 2
+            # Equatorial lines have cos2_alpha == 0
+            c2sm = np.where(c2a == 0, 0.0, cs - 2 * s1 * s2 / c2a)
+            C = f / 16 * c2a * (4 + f * (4 - 3 * c2a))
+            l_next = L_f[active] + (1 - C) * f * sin_alpha * (sg + C * ss * (c2sm + C * cs * (-1 + 2 * c2sm ** 2)))
+
+            sin_sigma_f[active], cos_sigma_f[active], sigma_f[active] = ss, cs, sg
+            cos2_alpha_f[active], cos_2sm_f[active] = c2a, c2sm
+            lam_f[active] = l_next
+            active = active[~(np.abs(l_next - l) < tol)]
+            if active.size == 0:
+                break
+
+    u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = B * sin_sigma * (cos_2sm + B / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sm ** 2) - B / 6 * cos_2sm * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sm ** 2)))
+    distance = np.asarray(WGS84_B * A * (sigma - delta_sigma) / 1000)
+
+    if active.size:
+        from geographiclib.geodesic import Geodesic
+        distance_f = distance.reshape(-1)
+        lat1_f, lon1_f, lat2_f, lon2_f = (x.reshape(-1) for x in (lat1_deg, lon1_deg, lat2_deg, lon2_deg))
+        for i in active:
+            distance_f[i] = Geodesic.WGS84.Inverse(lat1_f[i], lon1_f[i], lat2_f[i], lon2_f[i])['s12'] / 1000
+    return distance
+
+
+def distances_km(lat1, lon1, lat2, lon2, method='ellipsoidal'):
+    if method == 'haversine':
+        return haversine_km(lat1, lon1, lat2, lon2)
+    return vincenty_km(lat1, lon1, lat2, lon2)
+
+
+def scores(distances, scale, snap):
+    score = MAX_SCORE * np.exp(-10 * np.asarray(distances, dtype=np.float64) / scale)
+    return np.where(score >= snap, MAX_SCORE, score)
+
+
+def score_daily(distances, scale=DAILY_SCALE):
+    return scores(distances, scale, DAILY_SNAP)
+
+
+def score_free_play(distances, scale=FREE_PLAY_SCALE):
+    return scores(distances, scale, FREE_PLAY_SNAP)
+
+
+def score_guesses(guess_lat, guess_lon, route_lat, route_lon, scale=DAILY_SCALE, method='ellipsoidal'):
+    """Distances (km) and rounded daily scores for arrays of guesses against arrays of targets"""
+    distances = distances_km(guess_lat, guess_lon, route_lat, route_lon, method=method)
+    return distances, np.rint(score_daily(distances, scale=scale)).astype(np.int64)
@@ -8,6 +8,10 @@ from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 from datetime import datetime
 import logging
 import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import prompt_context
 
 load_dotenv()
 Base = declarative_base()
@@ -40,7 +44,7 @@ class ClimbingRoute(Base):
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
 
-# Define New Tables (mp_descriptions, mp_comments, top_area_routes, TODO gen_descriptions )
+# Define New Tables (mp_descriptions, mp_comments, route_prompt_contexts, top_area_routes, TODO gen_descriptions )
 
 
 class MpDescriptions(Base):
@@ -71,6 +75,17 @@ class MpComments(Base):
 
     route = relationship('ClimbingRoute')
 
+
+class RoutePromptContext(Base):
+    __tablename__ = 'route_prompt_contexts'
+    route_id = Column(Integer, ForeignKey('climbing_routes.id'), primary_key=True)
+    description = Column(Text, nullable=False)
+    comment_digest = Column(Text, nullable=False)
+    comments_used = Column(Integer, nullable=False)
+    prompt = Column(Text, nullable=False)
+    prompt_tokens = Column(Integer, nullable=False)
+    built_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
 def init_db(key, exist=True):
     engine = create_engine(key)
     Base.metadata.create_all(engine)
@@ -198,6 +213,7 @@ def db_upload_desc(db_session, route_id, route_name, description, location, prot
     db_session.add(new_entry)
     db_session.commit()
     logging.info(f"Added new description for route_id: {route_id}")
+    return new_entry
 
 def db_upload_comments(db_session, route_id, comments):
     for comment_text in comments:
@@ -209,6 +225,14 @@ def db_upload_comments(db_session, route_id, comments):
     db_session.commit()
     logging.info(f"Added {len(comments)} new comment(s) for route_id: {route_id}")
 
+def db_upload_prompt_context(db_session, description_entry):
+    comments = [row.comment_text for row in db_session.query(MpComments).filter_by(route_id=description_entry.route_id)]
+    area = db_session.get(ClimbingArea, description_entry.area_id)
+    context = prompt_context.build_context(description_entry, comments, area.area_name if area else None)
+    db_session.merge(RoutePromptContext(**context, built_at=datetime.utcnow()))
+    db_session.commit()
+    logging.info(f"Built prompt context for route_id: {description_entry.route_id} ({context['prompt_tokens']} tokens)")
+
 if __name__ == '__main__':
     MP_ACCOUNT = os.getenv('MP_EMAIL')
     MP_PASSWORD = os.getenv('MP_PASSWORD')
@@ -262,8 +286,9 @@ if __name__ == '__main__':
                 continue
             route_id = route.id
 
-            db_upload_desc(db_session, route_id, route_name, description, location, protection, route_type, pitches, length, grade, protection_rating, main_area, crag, AREA_ID)
+            description_entry = db_upload_desc(db_session, route_id, route_name, description, location, protection, route_type, pitches, length, grade, protection_rating, main_area, crag, AREA_ID)
             db_upload_comments(db_session, route_id, comments)
+            db_upload_prompt_context(db_session, description_entry)
 
             time.sleep(5)
     else:
@@ -1,14 +1,31 @@
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, send_file, abort
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_dance.contrib.google import make_google_blueprint, google
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func
+from sqlalchemy import func, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.mutable import MutableList
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
+from array import array
+from collections import deque
+from contextlib import contextmanager
+from bisect import bisect_left, insort
 import os
+import time
+import click
 import logging
+import threading
+import secrets
+import struct
+import json
 from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.http import unquote_etag
+from itsdangerous import URLSafeSerializer, BadSignature
+import scoring
+import prompt_context
+import route_search
+import llm
 
 
 try:
@@ -26,6 +43,8 @@ app.secret_key = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
 app.config['TEMPLATES_AUTO_RELOAD'] = True
 app.config['SQLALCHEMY_DATABASE_URI'] = neon_connection
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+if os.getenv('FREE_PLAY_STORE_URL'):
+    app.config['SQLALCHEMY_BINDS'] = {'game_store': os.getenv('FREE_PLAY_STORE_URL')}
 app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
     'pool_size': 10,
     'pool_recycle': 3600,
@@ -75,9 +94,17 @@ class DailyAttempt(db.Model):
     level_scores = db.Column(MutableList.as_mutable(db.JSON))
     total_score = db.Column(db.Integer)
     distance = db.Column(MutableList.as_mutable(db.JSON))
+    completed = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
     completed_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    __table_args__ = (db.UniqueConstraint('user_id', 'challenge_date', name='_user_date_uc'),)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'challenge_date', name='_user_date_uc'),
+        # Leaderboard pages and player counts read only a day's finished attempts in score order; the included
+        # columns let Postgres serve a leaderboard page from the index alone
+        db.Index('ix_daily_attempts_completed_score', challenge_date, total_score.desc(),
+                 postgresql_where=completed, postgresql_include=['id', 'user_id', 'level_scores'],
+                 sqlite_where=completed == True),
+    )
 
 class DailyRouteData(db.Model):
     __tablename__ = 'daily_route_data'
@@ -189,7 +216,7 @@ class MpDescriptions(db.Model):
     protection_rating = db.Column(db.Text)
     main_area = db.Column(db.Text)
     crag = db.Column(db.Text)
-    area_id = db.Column(db.Integer)
+    area_id = db.Column(db.Integer, index=True)
 
     route = db.relationship('ClimbingRoute')
 
@@ -216,10 +243,21 @@ class MpComments(db.Model):
 
     route = db.relationship('ClimbingRoute')
 
+class RoutePromptContext(db.Model):
+    """The Legendary Lines prompt for a route, built once by the constructor pipeline (prompt_context.py)"""
+    __tablename__ = 'route_prompt_contexts'
+    route_id = db.Column(db.Integer, db.ForeignKey('climbing_routes.id'), primary_key=True)
+    description = db.Column(db.Text, nullable=False)
+    comment_digest = db.Column(db.Text, nullable=False)
+    comments_used = db.Column(db.Integer, nullable=False)
+    prompt = db.Column(db.Text, nullable=False)
+    prompt_tokens = db.Column(db.Integer, nullable=False)
+    built_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
 class LLMDescriptions(db.Model):
     __tablename__ = 'llm_descriptions'
     id = db.Column(db.Integer, primary_key=True)
-    route_id = db.Column(db.Integer, db.ForeignKey('climbing_routes.id'), nullable=False)
+    route_id = db.Column(db.Integer, db.ForeignKey('climbing_routes.id'), nullable=False, index=True)
     description = db.Column(db.Text)
     hint = db.Column(db.Text)
     is_daily = db.Column(db.Boolean)
@@ -227,6 +265,125 @@ class LLMDescriptions(db.Model):
 
     route = db.relationship('ClimbingRoute')
 
+class UserScoreRollup(db.Model):
+    __tablename__ = 'user_score_rollups'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    period = db.Column(db.String(10), nullable=False)          # 'week', 'month' or 'all'
+    period_start = db.Column(db.Date, nullable=False)
+    total_score = db.Column(db.Integer, nullable=False, default=0)
+    days_played = db.Column(db.Integer, nullable=False, default=0)
+    best_score = db.Column(db.Integer, nullable=False, default=0)
+
+    user = db.relationship('User')
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'period', 'period_start', name='_user_period_uc'),
+        db.Index('ix_user_score_rollups_rank', period, period_start, total_score.desc()),
+    )
+
+    periods = ('week', 'month', 'all')
+
+    @staticmethod
+    def period_start_for(period, challenge_date):
+        if period == 'week':
+            return challenge_date - timedelta(days=challenge_date.weekday())
+        if period == 'month':
+            return challenge_date.replace(day=1)
+        return date(1970, 1, 1)
+
+    @property
+    def average_score(self):
+        return self.total_score / self.days_played if self.days_played else 0
+
+class UserStats(db.Model):
+    __tablename__ = 'user_stats'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    days_played = db.Column(db.Integer, nullable=False, default=0)
+    total_score = db.Column(db.Integer, nullable=False, default=0)
+    current_streak = db.Column(db.Integer, nullable=False, default=0)
+    longest_streak = db.Column(db.Integer, nullable=False, default=0)
+    last_played = db.Column(db.Date)
+    best_score = db.Column(db.Integer, nullable=False, default=0)
+    best_date = db.Column(db.Date)
+    level_score_sums = db.Column(MutableList.as_mutable(db.JSON))
+    score_histogram = db.Column(MutableList.as_mutable(db.JSON))
+    distance_histogram = db.Column(MutableList.as_mutable(db.JSON))
+
+    # Daily totals in 2,500 point buckets, the last one including a perfect 25,000; guess distances (km) in
+    # log-spaced buckets
+    score_bucket_size = 2500
+    distance_edges = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+    def add_attempt(self, challenge_date, level_scores, distances, total_score):
+        if self.level_score_sums is None:
+            self.level_score_sums = [0] * 5
+            self.score_histogram = [0] * (25000 // self.score_bucket_size)
+            self.distance_histogram = [0] * (len(self.distance_edges) + 1)
+        if self.last_played is not None and challenge_date <= self.last_played:
+            return
+
+        if self.last_played == challenge_date - timedelta(days=1):
+            self.current_streak += 1
+        else:
+            self.current_streak = 1
+        self.longest_streak = max(self.longest_streak, self.current_streak)
+        self.last_played = challenge_date
+
+        self.days_played += 1
+        self.total_score += total_score
+        if total_score > self.best_score or self.best_date is None:
+            self.best_score = total_score
+            self.best_date = challenge_date
+
+        for i, score in enumerate(level_scores[:5]):
+            self.level_score_sums[i] += score
+        self.score_histogram[min(total_score // self.score_bucket_size, len(self.score_histogram) - 1)] += 1
+        for distance in distances:
+            self.distance_histogram[bisect_left(self.distance_edges, distance)] += 1
+
+    def median_distance(self):
+        """Median guess distance (km), interpolated within its histogram bucket"""
+        counts = self.distance_histogram or []
+        total = sum(counts)
+        if not total:
+            return None
+        edges = [0] + self.distance_edges + [self.distance_edges[-1] * 4]
+        seen = 0
+        for i, count in enumerate(counts):
+            if count and seen + count >= total / 2:
+                return edges[i] + (edges[i + 1] - edges[i]) * (total / 2 - seen) / count
+            seen += count
+
+    def to_dict(self, today):
+        # A streak is only current if yesterday or today was played
+        streak_alive = self.last_played is not None and self.last_played >= today - timedelta(days=1)
+        return {
+            'days_played': self.days_played,
+            'current_streak': self.current_streak if streak_alive else 0,
+            'longest_streak': self.longest_streak,
+            'best_score': self.best_score,
+            'best_date': self.best_date.isoformat() if self.best_date else None,
+            'average_score': self.total_score / self.days_played if self.days_played else None,
+            'average_level_scores': [total / self.days_played for total in self.level_score_sums]
+                                    if self.days_played else [None] * 5,
+            # Only the histogram is stored, so the median is interpolated within its bucket
+            'median_distance_km': self.median_distance(),
+            'median_distance_estimated': True,
+            'score_histogram': [
+                {'min': i * self.score_bucket_size, 'max': (i + 1) * self.score_bucket_size, 'count': count}
+                for i, count in enumerate(self.score_histogram or [])
+            ],
+        }
+
+class FreePlayGameRecord(db.Model):
+    __tablename__ = 'free_play_games'
+    # Kept in its own database when FREE_PLAY_STORE_URL is set, e.g. a SQLite file shared by local workers
+    __bind_key__ = 'game_store' if os.getenv('FREE_PLAY_STORE_URL') else None
+    id = db.Column(db.String(32), primary_key=True)
+    record = db.Column(db.LargeBinary, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
 class Calculations:
     def __init__(self):
         self.user_data = {
@@ -239,12 +396,11 @@ class Calculations:
         }
 
     def distance_finder(self, user_coords, route_coords):
-        from geopy.distance import geodesic
         user_coords_list = [user_coords['user_lat'],user_coords['user_lon']]
         route_coords_list = [route_coords['route_lat'],route_coords['route_lon']]
-        distance = geodesic(user_coords_list, route_coords_list)
+        distance = scoring.distances_km(*user_coords_list, *route_coords_list)
         logging.debug(f"user_coords: {user_coords_list}, route_coords: {route_coords_list}")
-        return distance.km
+        return float(distance)
 
     def find_cesium_zoom(self, distance, fov = 30, padding = 2):
         from math import radians, sin, tan
@@ -259,19 +415,35 @@ class Calculations:
         return height_km * 1000
 
     def find_score_daily(self, distance):
-        from math import e
-        scale = 300
-        score = 5000 * (e **  (-10 * distance / scale))
-        if score >= 4992:
-            score = 5000
-        return score
+        return float(scoring.score_daily(distance))
 
     def find_score_free_play(self, distance):
-        from math import e
-        score = 5000 * (e **  (-10 * distance / 30))
-        if score >= 4990:
-            score = 5000
-        return score
+        return float(scoring.score_free_play(distance))
+
+    def get_route_type_str(self, route_type):
+        if route_type == "TR":
+            return "Top Rope"
+        elif route_type == "Trad":
+            return "Trad Climb"
+        elif route_type == "Sport":
+            return "Sport Climb"
+        elif route_type == "Boulder":
+            return "Boulder"
+        else:
+            return "Unknown"
+
+    def get_stars_str(self, route_stars):
+        stars = int(route_stars)
+        if stars == 0:
+            return "💣"
+        elif stars <= 1.6:
+            return "★☆☆☆"
+        elif stars <= 2.6:
+            return "★★☆☆"
+        elif stars <= 3.6:
+            return "★★★☆"
+        else:
+            return "★★★★"
 
     def get_score_class(self, score):
         """Return CSS class based on score (assuming max is 5000)"""
@@ -300,29 +472,141 @@ class Calculations:
         else:
             return 'total-bad'
 
+class RouteIndex:
+    """Per-worker area -> route -> image lookup so games can be sampled without DB round trips"""
+    def __init__(self, ttl=3600, unknown_rebuild_seconds=60):
+        self.ttl = ttl
+        self.unknown_rebuild_seconds = unknown_rebuild_seconds
+        self.area_routes = {}
+        self.route_images = {}
+        self.area_coords = {}
+        self.built_at = None
+        self.unknown_rebuilt_at = 0
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def build(self):
+        route_images = {}
+        for image_id, route_id in db.session.query(RouteImage.id, RouteImage.route_id).order_by(RouteImage.id):
+            route_images.setdefault(route_id, array('i')).append(image_id)
+
+        # Routes without images can never be played, so they are left out of the index
+        area_routes = {}
+        for route_id, area_id in db.session.query(ClimbingRoute.id, ClimbingRoute.area_id).order_by(ClimbingRoute.id):
+            if route_id in route_images:
+                area_routes.setdefault(area_id, array('i')).append(route_id)
+
+        area_coords = {}
+        for area_id, area_lat, area_lon in db.session.query(ClimbingArea.id, ClimbingArea.area_lat, ClimbingArea.area_lon):
+            if area_id in area_routes:
+                area_coords[area_id] = (area_lat, area_lon)
+
+        with self._lock:
+            self.area_routes = area_routes
+            self.route_images = route_images
+            self.area_coords = area_coords
+            self.built_at = time.time()
+        logging.info(f"Route index built: {len(area_routes)} areas, {len(route_images)} routes")
+
+    def stale(self):
+        return self.built_at is None or time.time() - self.built_at > self.ttl
+
+    def ensure_built(self):
+        if self.stale():
+            # One thread rebuilds; the others wait for it and then find the index fresh
+            with self._build_lock:
+                if self.stale():
+                    self.build()
+
+    def area_ids(self):
+        self.ensure_built()
+        return list(self.area_routes.keys())
+
+    def known(self, area_ids):
+        """Whether every area has playable routes. An unknown area may have been added by the scraper since the
+        last build, so it triggers a rebuild, but at most one every unknown_rebuild_seconds: bogus ids can't
+        force a table scan per request"""
+        self.ensure_built()
+        if all(area_id in self.area_routes for area_id in area_ids):
+            return True
+        with self._build_lock:
+            if time.time() - self.unknown_rebuilt_at >= self.unknown_rebuild_seconds:
+                self.unknown_rebuilt_at = time.time()
+                self.build()
+        return all(area_id in self.area_routes for area_id in area_ids)
+
+    def sample(self, area_ids):
+        from random import choice
+        if not self.known(area_ids):
+            raise ValueError(f"No playable routes for some of the areas in {area_ids}")
+
+        route_ids = []
+        img_ids = []
+        for area_id in area_ids:
+            route_id = choice(self.area_routes[area_id])
+            route_ids.append(route_id)
+            img_ids.append(choice(self.route_images[route_id]))
+        return route_ids, img_ids
+
+
+route_index = RouteIndex(ttl=int(os.getenv('ROUTE_INDEX_TTL', 3600)),
+                         unknown_rebuild_seconds=int(os.getenv('ROUTE_INDEX_UNKNOWN_REBUILD_SECONDS', 60)))
+
+def sample_game_sql(area_ids):
+    """Pick a route and image for every slot in area_ids with a single SQL statement"""
+    slot_rows = ", ".join(f"({slot}, :area_{slot})" for slot in range(len(area_ids)))
+    params = {f"area_{slot}": int(area_id) for slot, area_id in enumerate(area_ids)}
+
+    # Route first, then image, so big-gallery routes aren't favoured. random() exists on Postgres and SQLite
+    statement = text(f"""
+        WITH slots(slot, area_id) AS (VALUES {slot_rows}),
+        picked_routes AS (
+            SELECT slot, route_id FROM (
+                SELECT s.slot, r.id AS route_id,
+                       row_number() OVER (PARTITION BY s.slot ORDER BY random()) AS rn
+                FROM slots s
+                JOIN climbing_routes r ON r.area_id = s.area_id
+                WHERE EXISTS (SELECT 1 FROM route_images i WHERE i.route_id = r.id)
+            ) ranked_routes
+            WHERE rn = 1
+        )
+        SELECT slot, route_id, image_id FROM (
+            SELECT p.slot, p.route_id, i.id AS image_id,
+                   row_number() OVER (PARTITION BY p.slot ORDER BY random()) AS rn
+            FROM picked_routes p
+            JOIN route_images i ON i.route_id = p.route_id
+        ) ranked_images
+        WHERE rn = 1
+        ORDER BY slot
+    """)
+    rows = db.session.execute(statement, params).all()
+    if len(rows) != len(area_ids):
+        raise ValueError(f"No playable routes for some of the areas in {area_ids}")
+
+    route_ids = [row.route_id for row in rows]
+    img_ids = [row.image_id for row in rows]
+    return route_ids, img_ids
+
+def sample_game(area_ids):
+    if os.getenv('GAME_SAMPLER', 'index') == 'sql':
+        return sample_game_sql(area_ids)
+    return route_index.sample(area_ids)
+
 def generate_free_play(area_ids_input):
-    from random import choice, choices
+    from random import choices
 
     all_area_ids = [int(area_id) for area_id in area_ids_input]
     area_ids = choices(all_area_ids, k=5)
     logging.debug(f"area_ids: {area_ids}")
 
-    route_ids = []
-    for area_id in area_ids:
-        routes_in_area = [row.id for row in ClimbingRoute.query.filter_by(area_id=area_id).all()]
-        route_ids.append(choice(routes_in_area))
-
-    img_ids = []
-    for route_id in route_ids:
-        all_images = RouteImage.query.filter_by(route_id=route_id).all()
-        image = choice(all_images)
-        img_ids.append(image.id)
+    route_ids, img_ids = sample_game(area_ids)
 
     # If only one area is selected, return that area's coordinates
     if len(all_area_ids) == 1:
-        area = ClimbingArea.query.filter_by(id=all_area_ids[0]).first()
-        area_lon = area.area_lon
-        area_lat = area.area_lat
+        area = route_index.area_coords.get(all_area_ids[0])
+        if area is None:
+            area = db.session.query(ClimbingArea.area_lat, ClimbingArea.area_lon).filter_by(id=all_area_ids[0]).one()
+        area_lat, area_lon = area
         zoom = 20000
     else:
         # For multiple areas, we'll need to calculate a center point or handle differently
@@ -334,6 +618,8 @@ def generate_free_play(area_ids_input):
     data = {'area_ids': area_ids, 'route_ids': route_ids, 'img_ids': img_ids, 'area_lat': area_lat, 'area_lon': area_lon, 'zoom': zoom}
     return data
 
+_daily_latch = threading.Lock()
+
 def generate_daily(entered_date = None):
     if entered_date is None:
         entered_date = date.today()
@@ -342,156 +628,1569 @@ def generate_daily(entered_date = None):
     if existing:
         return existing
 
-    from random import choices, choice
-    all_area_ids = [row.id for row in ClimbingArea.query.all()]
-    area_ids = choices(all_area_ids, k = 5)
-
-    route_ids = []
-    for area_id in area_ids:
-        routes_in_area = [row.id for row in ClimbingRoute.query.filter_by(area_id=area_id).all()]
-        route_ids.append(choice(routes_in_area))
-
-    img_ids = []
-    for route_id in route_ids:
-        all_images = RouteImage.query.filter_by(route_id=route_id).all()
-        image = choice(all_images)
-        img_ids.append(image.id)
-
-    new_daily = DailyRouteData(
-        challenge_date=entered_date,
-        route_one_id=route_ids[0],
-        route_two_id=route_ids[1],
-        route_three_id=route_ids[2],
-        route_four_id=route_ids[3],
-        route_five_id=route_ids[4],
-        image_one_id=img_ids[0],
-        image_two_id=img_ids[1],
-        image_three_id=img_ids[2],
-        image_four_id=img_ids[3],
-        image_five_id=img_ids[4]
-    )
-    db.session.add(new_daily)
-    db.session.commit()
+    # Single-flight: one creator per process, and per database on Postgres via an advisory lock
+    with _daily_latch:
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"),
+                               {'key': int(entered_date.strftime('%Y%m%d'))})
+        existing = DailyRouteData.query.filter_by(challenge_date=entered_date).first()
+        if existing:
+            db.session.commit()
+            return existing
+
+        from random import choices
+        area_ids = choices(route_index.area_ids(), k = 5)
+        route_ids, img_ids = sample_game(area_ids)
+
+        new_daily = DailyRouteData(
+            challenge_date=entered_date,
+            route_one_id=route_ids[0],
+            route_two_id=route_ids[1],
+            route_three_id=route_ids[2],
+            route_four_id=route_ids[3],
+            route_five_id=route_ids[4],
+            image_one_id=img_ids[0],
+            image_two_id=img_ids[1],
+            image_three_id=img_ids[2],
+            image_four_id=img_ids[3],
+            image_five_id=img_ids[4]
+        )
+        db.session.add(new_daily)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another creator without the advisory lock (e.g. SQLite, another host) won the race
+            db.session.rollback()
+            return DailyRouteData.query.filter_by(challenge_date=entered_date).one()
 
     return new_daily
 
-def generate_legendary_lines(area_id):
-    from random import choice
-    from google import genai
-    from google.genai import types
-    from google.api_core.exceptions import ResourceExhausted
+def pregenerate_dailies(days, start_date = None):
+    if start_date is None:
+        start_date = date.today()
+    created = []
+    for offset in range(days):
+        challenge_date = start_date + timedelta(days=offset)
+        if DailyRouteData.query.filter_by(challenge_date=challenge_date).first() is None:
+            generate_daily(entered_date=challenge_date)
+            created.append(challenge_date)
+    return created
+
+class DailyScheduler:
+    """In-process timer that keeps the next few days of DailyRouteData created ahead of time"""
+    def __init__(self, days=3, interval=3600):
+        self.days = days
+        self.interval = interval
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="daily-scheduler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                with app.app_context():
+                    created = pregenerate_dailies(self.days)
+                if created:
+                    logging.info(f"Pre-generated dailies for {created}")
+            except Exception as err:
+                logging.error(f"Daily pre-generation failed: {err}")
+            time.sleep(self.interval)
+
+
+daily_scheduler = DailyScheduler(
+    days=int(os.getenv('DAILY_PREGENERATE_DAYS', 3)),
+    interval=int(os.getenv('DAILY_SCHEDULER_INTERVAL', 3600)),
+)
 
-    all_routes_in_area = MpDescriptions.query.filter_by(area_id=area_id).all()
-    route = choice(all_routes_in_area)
-    logging.debug(f"route: {route.route_name}")
+def append_daily_guess(user_id, challenge_date, level, guess_lat, guess_lon, distance, score):
+    """Append one level's guess to a DailyAttempt in a single conditional UPDATE.
+
+    Only applies when the attempt has exactly level - 1 completed levels, so a double submit can't
+    append twice. Returns the new (id, completed_levels, level_scores, distance, total_score) row, or
+    None when nothing changed.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        def append(column, param, sql_type):
+            return f"{column} = (COALESCE({column}::jsonb, '[]'::jsonb) || to_jsonb(CAST(:{param} AS {sql_type})))::json"
+        level_count = "json_array_length(COALESCE(level_scores, '[]'::json))"
+        float_type = "double precision"
+    else:
+        # SQLite fallback, json_insert with '$[#]' appends to the array
+        def append(column, param, sql_type):
+            return f"{column} = json_insert(COALESCE({column}, '[]'), '$[#]', CAST(:{param} AS {sql_type}))"
+        level_count = "json_array_length(COALESCE(level_scores, '[]'))"
+        float_type = "REAL"
+
+    statement = text(f"""
+        UPDATE daily_attempts SET
+            {append('lat_guess', 'guess_lat', float_type)},
+            {append('lon_guess', 'guess_lon', float_type)},
+            {append('distance', 'distance', float_type)},
+            {append('level_scores', 'score', 'INTEGER')},
+            total_score = COALESCE(total_score, 0) + :score,
+            completed = :completed_now
+        WHERE user_id = :user_id AND challenge_date = :challenge_date AND {level_count} = :completed
+        RETURNING id, {level_count} AS completed_levels, level_scores, distance, total_score
+    """).columns(id=db.Integer, completed_levels=db.Integer, level_scores=db.JSON, distance=db.JSON,
+                 total_score=db.Integer)
+    state = db.session.execute(statement, {
+        'guess_lat': float(guess_lat),
+        'guess_lon': float(guess_lon),
+        'distance': float(distance),
+        'score': int(score),
+        'user_id': user_id,
+        'challenge_date': challenge_date,
+        'completed': level - 1,
+        'completed_now': level == 5,
+    }).first()
+    db.session.commit()
+    return state
+
+class DailyLeaderboard:
+    """Completed attempts for one day kept in rank order, with O(log n) rank lookups.
+
+    Loaded from daily_attempts once and then updated as attempts finish. Other workers' completions
+    are picked up by reloading every reload_seconds.
+    """
+    def __init__(self, page_size=50, reload_seconds=60):
+        self.page_size = page_size
+        self.reload_seconds = reload_seconds
+        self.challenge_date = None
+        self.loaded_at = None
+        self.keys = []
+        self.entries = {}
+        self.user_keys = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def rank_key(attempt_id, total_score):
+        # Higher score first, earlier attempt wins ties
+        return (-total_score, attempt_id)
+
+    def load(self, challenge_date):
+        rows = db.session.query(
+            DailyAttempt.id, DailyAttempt.user_id, DailyAttempt.level_scores, DailyAttempt.total_score, User.username
+        ).join(User, User.id == DailyAttempt.user_id).filter(
+            DailyAttempt.challenge_date == challenge_date,
+            DailyAttempt.completed
+        ).all()
+
+        keys, entries, user_keys = [], {}, {}
+        for row in rows:
+            key = self.rank_key(row.id, row.total_score)
+            keys.append(key)
+            entries[key] = {'user_id': row.user_id, 'username': row.username,
+                            'level_scores': list(row.level_scores), 'total_score': row.total_score}
+            user_keys[row.user_id] = key
+        keys.sort()
+
+        with self._lock:
+            self.challenge_date = challenge_date
+            self.keys, self.entries, self.user_keys = keys, entries, user_keys
+            self.loaded_at = time.time()
+
+    def ensure_loaded(self, challenge_date):
+        if self.challenge_date != challenge_date or time.time() - self.loaded_at > self.reload_seconds:
+            self.load(challenge_date)
+
+    def record(self, challenge_date, attempt_id, user_id, username, level_scores, total_score):
+        with self._lock:
+            if self.challenge_date != challenge_date:
+                return
+            old_key = self.user_keys.get(user_id)
+            if old_key is not None:
+                del self.keys[bisect_left(self.keys, old_key)]
+                del self.entries[old_key]
+            key = self.rank_key(attempt_id, total_score)
+            insort(self.keys, key)
+            self.entries[key] = {'user_id': user_id, 'username': username,
+                                 'level_scores': list(level_scores), 'total_score': total_score}
+            self.user_keys[user_id] = key
+
+    def rank_of(self, challenge_date, user_id):
+        self.ensure_loaded(challenge_date)
+        with self._lock:
+            key = self.user_keys.get(user_id)
+            if key is None:
+                return None
+            return bisect_left(self.keys, key) + 1
+
+    def page(self, challenge_date, page):
+        """Entries on a 1-based page, each with its rank, and the total number of pages"""
+        self.ensure_loaded(challenge_date)
+        with self._lock:
+            pages = max(1, -(-len(self.keys) // self.page_size))
+            page = min(max(page, 1), pages)
+            start = (page - 1) * self.page_size
+            entries = [dict(self.entries[key], rank=start + i + 1)
+                       for i, key in enumerate(self.keys[start:start + self.page_size])]
+            return entries, page, pages, len(self.keys)
+
+    def page_of(self, rank):
+        return (rank - 1) // self.page_size + 1
+
+
+daily_leaderboard_service = DailyLeaderboard(
+    page_size=int(os.getenv('LEADERBOARD_PAGE_SIZE', 50)),
+    reload_seconds=int(os.getenv('LEADERBOARD_RELOAD_SECONDS', 60)),
+)
+
+def update_score_rollups(user_id, challenge_date, total_score):
+    """Fold one completed daily into the user's weekly, monthly and all-time rollups in one upsert"""
+    rows = []
+    params = {'user_id': user_id, 'score': total_score}
+    for i, period in enumerate(UserScoreRollup.periods):
+        rows.append(f"(:user_id, :period_{i}, :start_{i}, :score, 1, :score)")
+        params[f"period_{i}"] = period
+        params[f"start_{i}"] = UserScoreRollup.period_start_for(period, challenge_date)
+
+    db.session.execute(text(f"""
+        INSERT INTO user_score_rollups (user_id, period, period_start, total_score, days_played, best_score)
+        VALUES {", ".join(rows)}
+        ON CONFLICT (user_id, period, period_start) DO UPDATE SET
+            total_score = user_score_rollups.total_score + excluded.total_score,
+            days_played = user_score_rollups.days_played + 1,
+            best_score = CASE WHEN excluded.best_score > user_score_rollups.best_score
+                              THEN excluded.best_score ELSE user_score_rollups.best_score END
+    """), params)
+    db.session.commit()
+
+def update_user_stats(user_id, challenge_date, level_scores, distances, total_score):
+    stats = db.session.query(UserStats).filter_by(user_id=user_id).with_for_update().first()
+    if stats is None:
+        stats = UserStats(user_id=user_id, days_played=0, total_score=0, current_streak=0,
+                          longest_streak=0, best_score=0)
+        db.session.add(stats)
+    stats.add_attempt(challenge_date, level_scores, distances, total_score)
+    db.session.commit()
+
+def record_completed_daily(challenge_date, state, user):
+    daily_leaderboard_service.record(challenge_date, state.id, user.id, user.username,
+                                     state.level_scores, state.total_score)
+    update_score_rollups(user.id, challenge_date, state.total_score)
+    update_user_stats(user.id, challenge_date, state.level_scores, state.distance, state.total_score)
+
+class DailyBundleCache:
+    """Process-level cache of one day's fully resolved daily routes, identical for every player"""
+    level_names = ["one", "two", "three", "four", "five"]
+
+    def __init__(self):
+        self.challenge_date = None
+        self.levels = None
+        self._lock = threading.Lock()
+
+    def get(self, challenge_date = None):
+        if challenge_date is None:
+            challenge_date = date.today()
+        with self._lock:
+            if self.challenge_date == challenge_date:
+                return self.levels
+
+        # A new date means rollover, the previous day's bundle is simply replaced
+        levels = self.build(challenge_date)
+        if levels is not None:
+            with self._lock:
+                self.challenge_date = challenge_date
+                self.levels = levels
+        return levels
+
+    def build(self, challenge_date):
+        options = []
+        for level_name in self.level_names:
+            options.append(db.joinedload(getattr(DailyRouteData, f"route_{level_name}")).joinedload(ClimbingRoute.climbing_area))
+            options.append(db.joinedload(getattr(DailyRouteData, f"image_{level_name}")))
+        daily_data = DailyRouteData.query.filter_by(challenge_date=challenge_date).options(*options).first()
+        if not daily_data:
+            return None
+
+        levels = []
+        for level_name in self.level_names:
+            route = getattr(daily_data, f"route_{level_name}")
+            image = getattr(daily_data, f"image_{level_name}")
+            levels.append({
+                'route_id': route.id,
+                'image_id': image.id,
+                'route_name': route.route_name,
+                'route_link': route.route_link,
+                'route_lat': route.route_lat,
+                'route_lon': route.route_lon,
+                'route_type': route.route_type,
+                'route_grade': route.route_grade,
+                'route_stars': route.route_stars,
+                'route_length': route.route_length,
+                'area_name': route.climbing_area.area_name,
+                'image_link': image.image_link,
+            })
+        return tuple(levels)
+
+
+daily_bundle = DailyBundleCache()
+
+class FreePlayPool:
+    """Warm pool of ready-made free-play games keyed by area selection, topped up by a background thread"""
+    def __init__(self, depth=3, idle_seconds=3600, prewarm=True):
+        self.depth = depth
+        self.idle_seconds = idle_seconds
+        self.prewarm = prewarm
+        self.games = {}
+        self.last_used = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def selection_key(area_ids):
+        return tuple(sorted(int(area_id) for area_id in area_ids))
+
+    def pop(self, area_ids):
+        key = self.selection_key(area_ids)
+        if self.depth <= 0:
+            return generate_free_play(key)
+        # Only selections that can be played become pool keys; the refill thread would fail on any other
+        if not route_index.known(key):
+            raise ValueError(f"No playable routes for some of the areas in {key}")
+
+        self.start()
+        with self._lock:
+            self.last_used[key] = time.time()
+            games = self.games.setdefault(key, deque())
+            game = games.popleft() if games else None
+            if game is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        self._wake.set()
+
+        if game is None:
+            game = generate_free_play(key)
+        return game
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="free-play-pool", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        if self.prewarm:
+            # Every single-area selection starts warm; unplayed ones age out through evict()
+            with app.app_context():
+                now = time.time()
+                with self._lock:
+                    for area_id in route_index.area_ids():
+                        self.games.setdefault((area_id,), deque())
+                        self.last_used.setdefault((area_id,), now)
+
+        while True:
+            try:
+                with app.app_context():
+                    self.refill()
+            except Exception as err:
+                logging.error(f"Free play pool refill failed: {err}")
+            self._wake.wait(timeout=30)
+            self._wake.clear()
+
+    def refill(self):
+        self.evict()
+        with self._lock:
+            keys = [key for key, games in self.games.items() if len(games) < self.depth]
+
+        for key in keys:
+            while True:
+                with self._lock:
+                    if key not in self.games or len(self.games[key]) >= self.depth:
+                        break
+                try:
+                    game = generate_free_play(key)
+                except Exception as err:
+                    # One bad selection must not stop the keys after it from being refilled
+                    logging.error(f"Free play pool dropping selection {key}: {err}")
+                    with self._lock:
+                        self.games.pop(key, None)
+                        self.last_used.pop(key, None)
+                    break
+                with self._lock:
+                    if key in self.games:
+                        self.games[key].append(game)
+
+    def evict(self):
+        cutoff = time.time() - self.idle_seconds
+        with self._lock:
+            stale = [key for key, used in self.last_used.items() if used < cutoff]
+            for key in stale:
+                self.games.pop(key, None)
+                self.last_used.pop(key, None)
+            self.evictions += len(stale)
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'depth': self.depth,
+                'selections': len(self.games),
+                'games_ready': sum(len(games) for games in self.games.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else None,
+                'evictions': self.evictions,
+            }
+
+
+free_play_pool = FreePlayPool(
+    depth=int(os.getenv('FREE_PLAY_POOL_DEPTH', 3)),
+    idle_seconds=int(os.getenv('FREE_PLAY_POOL_IDLE_SECONDS', 3600)),
+    prewarm=os.getenv('FREE_PLAY_POOL_PREWARM', '1') == '1',
+)
+
+class FreePlayGame:
+    """One free-play game as a fixed-size record: the sampled levels, camera start and every guess so far"""
+    levels = 5
+    # area ids, route ids, image ids, area lat/lon, zoom, levels played, guess lats, guess lons, distances, scores
+    layout = struct.Struct("<5i5i5idddB5d5d5d5i")
+
+    def __init__(self, area_ids, route_ids, img_ids, area_lat, area_lon, zoom,
+                 levels_played=0, guesses_lat=None, guesses_lon=None, distances=None, scores=None):
+        self.area_ids = list(area_ids)
+        self.route_ids = list(route_ids)
+        self.img_ids = list(img_ids)
+        self.area_lat = area_lat
+        self.area_lon = area_lon
+        self.zoom = zoom
+        self.levels_played = levels_played
+        self.guesses_lat = list(guesses_lat or [])[:levels_played]
+        self.guesses_lon = list(guesses_lon or [])[:levels_played]
+        self.distances = list(distances or [])[:levels_played]
+        self.scores = list(scores or [])[:levels_played]
+
+    @classmethod
+    def from_data(cls, data):
+        return cls(data['area_ids'], data['route_ids'], data['img_ids'], data['area_lat'], data['area_lon'], data['zoom'])
+
+    @classmethod
+    def unpack(cls, record):
+        values = cls.layout.unpack(record)
+        return cls(values[0:5], values[5:10], values[10:15], values[15], values[16], values[17], values[18],
+                   values[19:24], values[24:29], values[29:34], values[34:39])
+
+    def pack(self):
+        def padded(values, fill=0):
+            return list(values) + [fill] * (self.levels - len(values))
+        return self.layout.pack(*self.area_ids, *self.route_ids, *self.img_ids, self.area_lat, self.area_lon,
+                                self.zoom, self.levels_played, *padded(self.guesses_lat, 0.0),
+                                *padded(self.guesses_lon, 0.0), *padded(self.distances, 0.0), *padded(self.scores))
+
+    def add_guess(self, guess_lat, guess_lon, distance, score):
+        self.guesses_lat.append(guess_lat)
+        self.guesses_lon.append(guess_lon)
+        self.distances.append(distance)
+        self.scores.append(score)
+        self.levels_played += 1
+
+    @property
+    def total_score(self):
+        return sum(self.scores)
+
+class InProcessGameStore:
+    """Free-play games held in this worker's memory, fine when a single worker serves every request"""
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.games = {}
+        self.puts = 0
+        self._lock = threading.Lock()
+
+    def get(self, game_id):
+        with self._lock:
+            entry = self.games.get(game_id)
+        if entry is None or entry[0] < time.time():
+            return None
+        return FreePlayGame.unpack(entry[1])
+
+    def put(self, game_id, game):
+        with self._lock:
+            self.games[game_id] = (time.time() + self.ttl, game.pack())
+            self.puts += 1
+            if self.puts % 1000 == 0:
+                self.evict()
+
+    def evict(self):
+        now = time.time()
+        for game_id in [game_id for game_id, (expires, _) in self.games.items() if expires < now]:
+            del self.games[game_id]
+
+    def size(self):
+        return len(self.games)
+
+class SqlGameStore:
+    """Free-play games in the free_play_games table, shared by every worker"""
+    def __init__(self, ttl, count_seconds=60):
+        self.ttl = ttl
+        self.count_seconds = count_seconds
+        self.puts = 0
+        self.counted = None
+
+    def get(self, game_id):
+        row = db.session.get(FreePlayGameRecord, game_id)
+        if row is None or row.expires_at < datetime.utcnow():
+            return None
+        return FreePlayGame.unpack(row.record)
+
+    def put(self, game_id, game):
+        db.session.merge(FreePlayGameRecord(id=game_id, record=game.pack(),
+                                            expires_at=datetime.utcnow() + timedelta(seconds=self.ttl)))
+        self.puts += 1
+        if self.puts % 1000 == 0:
+            self.evict()
+        db.session.commit()
+
+    def evict(self):
+        FreePlayGameRecord.query.filter(FreePlayGameRecord.expires_at < datetime.utcnow()).delete()
+
+    def size(self):
+        """Stored games, expired ones included. Counting scans the table, so the count is reused for
+        count_seconds rather than taken on every metrics request"""
+        if self.counted is None or time.time() - self.counted[0] > self.count_seconds:
+            self.counted = (time.time(), FreePlayGameRecord.query.count())
+        return self.counted[1]
+
+
+free_play_store_ttl = int(os.getenv('FREE_PLAY_GAME_TTL', 6 * 3600))
+if os.getenv('FREE_PLAY_STORE', 'memory') == 'sql':
+    free_play_store = SqlGameStore(free_play_store_ttl)
+else:
+    free_play_store = InProcessGameStore(free_play_store_ttl)
 
-    chosen_route_id = route.route_id
-    comments = MpComments.query.filter_by(route_id=chosen_route_id).order_by(func.random()).limit(5).all()
-    logging.debug(f"comments: {comments}")
-
-    route_name = route.route_name
-    description_string = route.description
-    route_grade = route.grade
-    length = route.length
-    crag = route.crag
-    sub_area = route.main_area
-    comment_string = ""
-    main_area = "Joshua Tree National Park" # TODO
-    yield f"data: ROUTE_ID:{chosen_route_id}\n\n"
-    for comment in comments:
-        comment_string += f"{comment.comment_text}"
-
-    prompt = f"The Route is {route_name}, {route_grade}, {length}ft long, at the crag {crag} in sub area of {sub_area}, in {main_area}. Description: {description_string}. User comments: {comment_string}."
-    output_desc = ""
-    output_hint = ""
-
-    generate_content = True
-    if generate_content:
+level_tokens = URLSafeSerializer(app.secret_key, salt='level-token')
+
+def make_level_token(mode, game_key, level):
+    return level_tokens.dumps([mode, game_key, level])
+
+def level_from_request(json, mode, game_key):
+    """Level number from a submit body, taken from its opaque token when one is sent"""
+    token = json.get('token')
+    if token is None:
+        return int(json['level'])
+    try:
+        token_mode, token_key, level = level_tokens.loads(token)
+    except BadSignature:
+        return None
+    if token_mode != mode or token_key != game_key:
+        return None
+    return level
+
+def current_free_play_game():
+    game_id = session.get('game_id')
+    if not game_id:
+        return None, None
+    return game_id, free_play_store.get(game_id)
+
+class ImageCache:
+    """On-disk LRU cache of route photos fetched from Mountain Project, with optional fixed-width resizes.
+
+    Cached photos are revalidated upstream with ETag/Last-Modified once they are older than
+    revalidate_seconds. Resizing needs Pillow; without it the original is served. File mtimes track LRU order
+    and move on every hit, so what the browser validates against is the content digest and stored_at kept in
+    each photo's metadata.
+    """
+    widths = (320, 640, 1280)
+
+    def __init__(self, directory, max_bytes, revalidate_seconds=86400, timeout=10):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.revalidate_seconds = revalidate_seconds
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self._size = None
+        self._lock = threading.Lock()
+        self._fetch_locks = {}
+
+    def _path(self, image_id, suffix):
+        return os.path.join(self.directory, f"{image_id}{suffix}")
+
+    def _read_meta(self, image_id):
         try:
-            client = genai.Client(
-                api_key=os.getenv("GEMINI_API_KEY"),
-            )
+            with open(self._path(image_id, ".json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path, data):
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        self._grow(len(data))
+
+    def _write_meta(self, image_id, meta):
+        with open(self._path(image_id, ".json.tmp"), "w") as f:
+            json.dump(meta, f)
+        os.replace(self._path(image_id, ".json.tmp"), self._path(image_id, ".json"))
+
+    def _with_validators(self, image_id, path, meta):
+        """Metadata with a content digest and stored_at, added once to entries cached before they existed"""
+        if 'digest' not in meta:
+            import hashlib
+            with open(path, "rb") as f:
+                meta['digest'] = hashlib.sha256(f.read()).hexdigest()[:32]
+            meta['stored_at'] = meta['fetched_at']
+            self._write_meta(image_id, meta)
+        return meta
+
+    @contextmanager
+    def _fetch_lock(self, image_id):
+        """Per-photo lock so concurrent misses fetch once. Each entry counts the requests holding or waiting on
+        it and is dropped by the last one, so the table only holds photos being worked on"""
+        with self._lock:
+            entry = self._fetch_locks.setdefault(image_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._fetch_locks[image_id]
+
+    def get(self, image_id, image_link=None):
+        """Path and metadata of the cached original, fetching or revalidating it first if needed"""
+        import requests
+
+        with self._fetch_lock(image_id):
+            path = self._path(image_id, ".img")
+            meta = self._read_meta(image_id)
+            cached = meta is not None and os.path.exists(path)
+            if cached and time.time() - meta['fetched_at'] < self.revalidate_seconds:
+                with self._lock:
+                    self.hits += 1
+                os.utime(path)
+                return path, self._with_validators(image_id, path, meta)
+
+            url = meta['url'] if meta else image_link
+            if url is None:
+                return None, None
+            headers = {}
+            if cached and meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if cached and meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+            try:
+                response = requests.get(url, headers=headers, timeout=self.timeout)
+            except requests.RequestException as err:
+                logging.warning(f"Image {image_id} fetch failed: {err}")
+                return (path, self._with_validators(image_id, path, meta)) if cached else (None, None)
+
+            if cached and response.status_code == 304:
+                with self._lock:
+                    self.revalidations += 1
+                meta['fetched_at'] = time.time()
+                self._write_meta(image_id, meta)
+                os.utime(path)
+                return path, self._with_validators(image_id, path, meta)
+            if response.status_code != 200:
+                logging.warning(f"Image {image_id} fetch returned {response.status_code}")
+                return (path, self._with_validators(image_id, path, meta)) if cached else (None, None)
+
+            import hashlib
+
+            with self._lock:
+                self.misses += 1
+            os.makedirs(self.directory, exist_ok=True)
+            self._remove_variants(image_id)
+            self._write(path, response.content)
+            meta = {
+                'url': url,
+                'content_type': response.headers.get('Content-Type', 'image/jpeg'),
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'fetched_at': time.time(),
+                'stored_at': time.time(),
+                'digest': hashlib.sha256(response.content).hexdigest()[:32],
+            }
+            self._write_meta(image_id, meta)
+        self.evict()
+        return path, meta
+
+    def get_resized(self, image_id, width, image_link=None):
+        path, meta = self.get(image_id, image_link)
+        if path is None or width not in self.widths:
+            return path, meta
+        try:
+            from PIL import Image
+        except ImportError:
+            return path, meta
+
+        resized_path = self._path(image_id, f"_w{width}.img")
+        with self._fetch_lock(image_id):
+            if not os.path.exists(resized_path):
+                try:
+                    with Image.open(path) as img:
+                        if img.width > width:
+                            img = img.resize((width, round(img.height * width / img.width)))
+                        with open(resized_path + ".tmp", "wb") as f:
+                            img.convert("RGB").save(f, format="JPEG", quality=85)
+                except OSError as err:
+                    # The original was evicted since get(), or Pillow can't read it
+                    logging.warning(f"Image {image_id} resize failed: {err}")
+                    return None, None
+                os.replace(resized_path + ".tmp", resized_path)
+                self._grow(os.path.getsize(resized_path))
+            else:
+                os.utime(resized_path)
+        return resized_path, dict(meta, content_type='image/jpeg', width=width)
+
+    def open_image(self, image_id, width=None, image_link=None):
+        """The cached photo, resized when width is one of `widths`, as an open binary file plus its metadata.
+        The open file stays readable if eviction removes it meanwhile. (None, None) when the photo isn't cached
+        and there is no image_link to fetch it from, or it was evicted before it could be opened"""
+        path, meta = self.get_resized(image_id, width, image_link) if width else self.get(image_id, image_link)
+        if path is None:
+            return None, None
+        try:
+            return open(path, "rb"), meta
+        except OSError:
+            return None, None
+
+    def _remove_variants(self, image_id):
+        for width in self.widths:
+            try:
+                os.remove(self._path(image_id, f"_w{width}.img"))
+            except OSError:
+                pass
+
+    def _grow(self, size):
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+
+    def size(self):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(entry.stat().st_size for entry in os.scandir(self.directory)
+                                 if entry.name.endswith(".img")) if os.path.isdir(self.directory) else 0
+            return self._size
+
+    def evict(self):
+        """Drop least recently used files until the cache is back under 90% of its budget"""
+        if self.size() <= self.max_bytes:
+            return
+        files = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                       for entry in os.scandir(self.directory) if entry.name.endswith(".img"))
+        target = self.max_bytes * 0.9
+        with self._lock:
+            for _, size, path in files:
+                if self._size <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                if "_w" not in os.path.basename(path):
+                    # Without its original the metadata is useless, the next request refetches from scratch
+                    try:
+                        os.remove(path[:-len(".img")] + ".json")
+                    except OSError:
+                        pass
+                self._size -= size
+                self.evictions += 1
+
+    def stats(self):
+        size = self.size()
+        with self._lock:
+            return {
+                'bytes': size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'evictions': self.evictions,
+            }
+
+
+image_cache = ImageCache(
+    directory=os.getenv('IMAGE_CACHE_DIR', os.path.join(app.instance_path, 'image_cache')),
+    max_bytes=int(os.getenv('IMAGE_CACHE_BYTES', 512 * 1024 * 1024)),
+    revalidate_seconds=int(os.getenv('IMAGE_CACHE_REVALIDATE_SECONDS', 86400)),
+)
+image_proxy_enabled = os.getenv('IMAGE_PROXY', '1') == '1'
+
+def image_src(image_id, image_link):
+    """URL the browser should load a route photo from: the caching proxy, or Mountain Project directly"""
+    if image_proxy_enabled:
+        return url_for('route_image', image_id=image_id)
+    return image_link
+
+preload_hints_enabled = os.getenv('PRELOAD_HINTS', '1') == '1'
+# What a level's results page loads on top of what the level page already has (Cesium.js and its
+# widgets.css are shared)
+RESULT_PAGE_ASSETS = (
+    ('styles/classic_result.css', 'style'),
+    ('scripts/classic_mode.js', 'script'),
+    ('scripts/cesium_result.js', 'script'),
+    ('images/user_pin.svg', 'image'),
+    ('images/route_pin.svg', 'image'),
+    ('images/nav-reset.svg', 'image'),
+)
 
-            model = "gemini-flash-lite-latest"
-            contents = [
-                types.Content(
-                    role="user",
-                    parts=[
-                        types.Part.from_text(text=prompt),
-                    ],
-                ),
-            ]
-            generate_content_config = types.GenerateContentConfig(
-                thinking_config=types.ThinkingConfig(
-                    thinking_budget=0,
-                ),
-                system_instruction=[
-                    #types.Part.from_text(text="""Formulate a four sentence summary of a climbing route given it's description and user comments. The summary should be detailed enough to allow someone to guess the route given a list of possible routes. Leave out any super specific information about the location, name, or type of anchor of the route."""),
-                    types.Part.from_text(text="""Provide four sentenced, detailed summary of a rock climbing route based on a route's description and comments. The summary should be detailed enough about the routes physical description to allow someone to guess the route given a list of possible routes. Do not include overly specific details to give this away (exact route name, exact crag name, exact difficulty, exact length), but hints towards those aspects is acceptable. Sub-area can occasionally be specified. Main area is already known by user. Naming conventions: cracks should be called cracks, refer to the climb as either a route or a boulder. Difficulty, 5.0 - 5.5 are called low-fifth class, 5.6-5.9 are called easy routes, - 5.10(a, b, c, and d) are moderate, 5.11a - 5.12a are hard, and 5.12b and higher are considered testpieces."""),
-                ],
-            )
+def add_level_hints(response, image_url, next_image_url=None):
+    """Link headers for a level page: preload its photo, and prefetch the results page's assets and the
+    next level's photo so they are in the browser cache by the time the player gets there"""
+    if not preload_hints_enabled:
+        return response
+    links = [f'<{image_url}>; rel=preload; as=image']
+    links += [f"<{url_for('static', filename=filename)}>; rel=prefetch; as={kind}"
+              for filename, kind in RESULT_PAGE_ASSETS]
+    if next_image_url:
+        links.append(f'<{next_image_url}>; rel=prefetch; as=image')
+    response.headers['Link'] = ', '.join(links)
+    return response
+
+class TransitionTimings:
+    """Level-to-level transition times reported by the browser (NEXT clicked on a results page until the
+    next level's photo is on screen), kept separately for pages served with and without preload hints"""
+
+    def __init__(self, window=1000):
+        self.samples = {}
+        self.window = window
+        self._lock = threading.Lock()
+
+    def record(self, mode, hinted, ms):
+        with self._lock:
+            self.samples.setdefault((mode, hinted), deque(maxlen=self.window)).append(ms)
+
+    def stats(self):
+        with self._lock:
+            snapshot = {key: sorted(samples) for key, samples in self.samples.items()}
+        result = {}
+        for (mode, hinted), samples in sorted(snapshot.items()):
+            result.setdefault(mode, {})['hinted' if hinted else 'unhinted'] = {
+                'count': len(samples),
+                'mean_ms': round(sum(samples) / len(samples), 1),
+                'p50_ms': samples[len(samples) // 2],
+                'p95_ms': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+            }
+        return result
+
+
+transition_timings = TransitionTimings(window=int(os.getenv('TRANSITION_TIMING_WINDOW', 1000)))
+
+def sse_data(text):
+    """One server-sent event. Multi-line text is split over several data: lines, which EventSource joins back
+    with newlines"""
+    return ''.join(f"data: {line}\n" for line in text.split('\n')) + "\n"
+
+def replay_chunks(text, words=6):
+    """Stored text cut into chunks of a few words, roughly what the model streams"""
+    import re
+    tokens = re.findall(r'\S+\s*|\s+', text)
+    for i in range(0, len(tokens), words):
+        yield ''.join(tokens[i:i + words])
+
+def replay_summary(summary_id, description):
+    yield 'round', summary_id
+    yield from (('text', chunk) for chunk in replay_chunks(description))
+    yield 'done', ''
+
+LL_DESCRIPTION_INSTRUCTION = """Provide four sentenced, detailed summary of a rock climbing route based on a route's description and comments. The summary should be detailed enough about the routes physical description to allow someone to guess the route given a list of possible routes. Do not include overly specific details to give this away (exact route name, exact crag name, exact difficulty, exact length), but hints towards those aspects is acceptable. Sub-area can occasionally be specified. Main area is already known by user. Naming conventions: cracks should be called cracks, refer to the climb as either a route or a boulder. Difficulty, 5.0 - 5.5 are called low-fifth class, 5.6-5.9 are called easy routes, - 5.10(a, b, c, and d) are moderate, 5.11a - 5.12a are hard, and 5.12b and higher are considered testpieces."""
+LL_HINT_INSTRUCTION = """Add an additional 3 sentences to continue a summary of a climbing route. Your addition should be more detailed than the initial you've already given, but still leave out super specific details. Summary: {prior_summary_instruction}."""
+
+llm_provider = llm.provider_from_env()
+
+def build_prompt_context(route):
+    """Builds and stores the prompt context for an MpDescriptions route"""
+    comments = [text for text, in db.session.query(MpComments.comment_text).filter_by(route_id=route.route_id)]
+    # mp_descriptions.main_area holds the sub area; the area the player picked is the climbing area
+    area = db.session.get(ClimbingArea, route.area_id) if route.area_id is not None else None
+    main_area = area.area_name if area else None
+    context = db.session.merge(RoutePromptContext(**prompt_context.build_context(route, comments, main_area),
+                                                  built_at=datetime.utcnow()))
+    db.session.commit()
+    return context
+
+def get_prompt_context(route):
+    """The route's stored prompt context: one primary-key read. Routes the constructor predates are built on
+    first use"""
+    context = db.session.get(RoutePromptContext, route.route_id)
+    if context is None:
+        logging.info(f"Building missing prompt context for route {route.route_id}")
+        context = build_prompt_context(route)
+    return context
+
+def stream_route_description(context):
+    """Streams a freshly generated description from a route's prompt context"""
+    yield from llm_provider.stream(LL_DESCRIPTION_INSTRUCTION, context.prompt)
+
+def generate_route_hint(context, description):
+    """The hint that continues a generated description"""
+    hint_prompt = "Your previous summary" + description + "And the original data: " + context.prompt
+    return ''.join(llm_provider.stream(LL_HINT_INSTRUCTION, hint_prompt))
+
+class SummaryFlight:
+    """One in-progress generation for a route. Every request for the route follows the same event log, so
+    concurrent players share a single description call. The log finishes with the description; the hint is
+    written after that without anyone following. When the last follower disconnects before the end, the flight
+    is marked cancelled and the generation stops"""
+    def __init__(self):
+        self.events = []
+        self.finished = False
+        self.exhausted = False
+        self.cancelled = False
+        self.followers = 0
+        self._cond = threading.Condition()
+
+    def publish(self, event):
+        with self._cond:
+            self.events.append(event)
+            self._cond.notify_all()
+
+    def finish(self):
+        with self._cond:
+            self.finished = True
+            self._cond.notify_all()
+
+    def follow(self, heartbeat=None):
+        """Events as they are published; ('heartbeat', '') after `heartbeat` seconds without one"""
+        seen = 0
+        with self._cond:
+            self.followers += 1
+        try:
+            while True:
+                with self._cond:
+                    if seen == len(self.events) and not self.finished:
+                        self._cond.wait(timeout=heartbeat)
+                    batch = self.events[seen:]
+                    finished = self.finished
+                if not batch and not finished:
+                    if heartbeat:
+                        yield 'heartbeat', ''
+                    continue
+                seen += len(batch)
+                yield from batch
+                if finished and seen == len(self.events):
+                    return
+        finally:
+            with self._cond:
+                self.followers -= 1
+                if self.followers == 0 and not self.finished:
+                    self.cancelled = True
+
+class LegendaryLinesContent:
+    """Cache-first descriptions and hints for Legendary Lines. A route with stored content is replayed from
+    llm_descriptions without calling the model. A route without any is generated once, in the background,
+    while the requests that asked for it stream along.
+
+    Each round is an llm_descriptions row, announced to the player as a ('round', id) event. The row is
+    inserted before the description streams, and the hint is written into it as soon as the description is
+    done, while the player is still reading; GET /api/ll/hint/<id> serves it from there.
+
+    A generation that fails before its description is done ends its events with ('failed', ''). While the
+    provider's circuit breaker is open no generation starts at all, and rounds come from fallback(): stored
+    content for any route in the area.
+
+    Regeneration policy: content older than max_age_days (0 keeps it forever) no longer counts, and each route
+    keeps up to `variants` descriptions. A route short of fresh variants still replays what it has, stale or
+    not, and tops itself up in the background. With replay off every round streams a new generation, which is
+    what load tests of the streaming path want."""
+    def __init__(self, max_age_days=0, variants=1, heartbeat_seconds=15, replay=True):
+        self.max_age_days = max_age_days
+        self.variants = variants
+        self.replay = replay
+        self.heartbeat_seconds = heartbeat_seconds
+        self.flights = {}
+        self.replays = 0
+        self.generations = 0
+        self.followers = 0
+        self.failures = 0
+        self.cancellations = 0
+        self.hints = 0
+        self.hint_failures = 0
+        self.hint_requests = 0
+        self.hints_pending = 0
+        self.rounds = 0
+        self.fallbacks = 0
+        self.fallback_misses = 0
+        self.fallback_ids = {}
+        self.fallback_ttl = 60
+        self._lock = threading.Lock()
+
+    def stored(self, route_id):
+        """Complete stored summaries for a route, newest first"""
+        return (LLMDescriptions.query
+                .filter(LLMDescriptions.route_id == route_id,
+                        LLMDescriptions.description != '',
+                        LLMDescriptions.hint != '')
+                .order_by(LLMDescriptions.date.desc())
+                .all())
+
+    def fresh(self, summaries):
+        if not self.max_age_days:
+            return summaries
+        cutoff = datetime.utcnow() - timedelta(days=self.max_age_days)
+        return [summary for summary in summaries if summary.date >= cutoff]
+
+    def stream(self, route):
+        """(kind, chunk) events for a round of a route's description, or None when the route has nothing stored
+        and the circuit breaker won't let it be generated. The database is only read here, up front, so the
+        caller can give its connection back before streaming"""
+        from random import choice
+
+        summaries = self.stored(route.route_id) if self.replay else []
+        fresh = self.fresh(summaries)
+        if (len(fresh) < self.variants or not self.replay) and not llm_provider.circuit_open():
+            flight = self.flight_for(route)
+            if not summaries:
+                with self._lock:
+                    self.followers += 1
+                return flight.follow(heartbeat=self.heartbeat_seconds)
+        if not summaries:
+            return None
+
+        with self._lock:
+            self.replays += 1
+        summary = choice(fresh or summaries)
+        return replay_summary(summary.id, summary.description)
+
+    def flight_for(self, route):
+        """The route's running generation, starting one if there is none"""
+        with self._lock:
+            flight = self.flights.get(route.route_id)
+            if flight is not None and not flight.cancelled:
+                return flight
+            flight = self.flights[route.route_id] = SummaryFlight()
+            self.generations += 1
+        threading.Thread(target=self._generate, args=(route.route_id, route.id, flight),
+                         name=f"ll-generate-{route.route_id}", daemon=True).start()
+        return flight
+
+    def _generate(self, route_id, description_id, flight):
+        try:
+            with app.app_context():
+                self._generate_and_store(description_id, flight)
+        except Exception as err:
+            logging.error(f"Legendary Lines generation failed for route {route_id}: {err}")
+            with self._lock:
+                self.failures += 1
+            if not flight.finished:
+                flight.publish(('failed', ''))
+        finally:
+            # Only drop the flight once the hint is committed too, so no request starts a second one
+            with self._lock:
+                if self.flights.get(route_id) is flight:
+                    del self.flights[route_id]
+            flight.finish()
+
+    def _generate_and_store(self, description_id, flight):
+        route = db.session.get(MpDescriptions, description_id)
+        context = get_prompt_context(route)
+        summary = LLMDescriptions(route_id=route.route_id, description='', hint='', is_daily=False)
+        db.session.add(summary)
+        db.session.commit()
+        flight.publish(('round', summary.id))
 
-            for chunk in client.models.generate_content_stream(
-                    model=model,
-                    contents=contents,
-                    config=generate_content_config,
-            ):
-                output_desc += chunk.text
-                yield f"data: {chunk.text}\n\n"
-            yield "data: [DONE]\n\n"
-
-            # Begin generating hint
-
-            contents = [
-                types.Content(
-                    role="user",
-                    parts=[
-                        types.Part.from_text(text="Your previous summary" + output_desc + "And the original data: " + prompt),
-                    ],
-                ),
-            ]
-            generate_content_config = types.GenerateContentConfig(
-                thinking_config=types.ThinkingConfig(
-                    thinking_budget=0,
-                ),
-                system_instruction=[
-
-                    types.Part.from_text(text="""Add an additional 3 sentences to continue a summary of a climbing route. Your addition should be more detailed than the initial you've already given, but still leave out super specific details. Summary: {prior_summary_instruction}."""),
-                ],
-            )
-            for chunk in client.models.generate_content_stream(
-                    model=model,
-                    contents=contents,
-                    config=generate_content_config,
-            ):
-                output_hint += chunk.text
-                yield f"data: [HINT]:{chunk.text}\n\n"
-            yield f"data: [HINT_DONE]\n\n"
-        except ResourceExhausted as err:
+        output_desc = ""
+        failed = False
+        chunks = stream_route_description(context)
+        try:
+            for chunk in chunks:
+                if flight.cancelled:
+                    # Closing the generator closes the provider's stream, which drops the upstream request
+                    chunks.close()
+                    break
+                output_desc += chunk
+                flight.publish(('text', chunk))
+        except llm.ResourceExhausted as err:
             logging.debug(f"ResourceExhausted {err}")
+            flight.exhausted = True
+            failed = True
+        except llm.LLMError as err:
+            # Deadlines and an open breaker: a half-written description is no good to anyone
+            logging.warning(f"Legendary Lines description failed for route {route.route_id}: {err}")
+            failed = True
         logging.debug(f"output_desc: {output_desc}")
-        logging.debug(f"output_hint: {output_hint}")
 
+        if flight.cancelled or failed or not output_desc:
+            db.session.delete(summary)
+            db.session.commit()
+            with self._lock:
+                if flight.cancelled:
+                    self.cancellations += 1
+                else:
+                    self.failures += 1
+            if not flight.cancelled:
+                flight.publish(('failed', ''))
+            return
         try:
-            new_summary = LLMDescriptions(
-                route_id=chosen_route_id,
-                description=output_desc,
-                hint=output_hint,
-                is_daily=False)
-            db.session.add(new_summary)
+            summary.description = output_desc
             db.session.commit()
         except Exception as err:
             db.session.rollback()
             raise err
+        flight.publish(('done', ''))
+        flight.finish()
 
-    else:
-        yield f"data: {prompt}\n\n"
-        yield "data: [DONE]\n\n"
+        # The players have their description; the hint is ready well before they have read it
+        try:
+            output_hint = generate_route_hint(context, output_desc)
+        except llm.LLMError as err:
+            logging.warning(f"Legendary Lines hint failed for route {route.route_id}: {err}")
+            output_hint = ""
+        logging.debug(f"output_hint: {output_hint}")
+        if not output_hint:
+            with self._lock:
+                self.hint_failures += 1
+            return
+        try:
+            summary.hint = output_hint
+            db.session.commit()
+        except Exception as err:
+            db.session.rollback()
+            raise err
+        with self._lock:
+            self.hints += 1
+
+    def fallback_candidates(self, area_id):
+        """Ids of the area's complete stored summaries, cached for fallback_ttl seconds: fallbacks happen while
+        the breaker is open, when streams are busiest, so each one is a primary-key read rather than a sort"""
+        with self._lock:
+            cached = self.fallback_ids.get(area_id)
+        if cached is not None and time.time() - cached[0] < self.fallback_ttl:
+            return cached[1]
+        ids = [summary_id for summary_id, in db.session.query(LLMDescriptions.id)
+               .join(MpDescriptions, MpDescriptions.route_id == LLMDescriptions.route_id)
+               .filter(MpDescriptions.area_id == area_id,
+                       LLMDescriptions.description != '',
+                       LLMDescriptions.hint != '')]
+        with self._lock:
+            self.fallback_ids[area_id] = (time.time(), ids)
+        return ids
+
+    def fallback(self, area_id):
+        """(route_id, events) replaying stored content for a random route in the area, or None if the area
+        has none yet"""
+        from random import choice
+
+        ids = self.fallback_candidates(area_id)
+        summary = db.session.get(LLMDescriptions, choice(ids)) if ids else None
+        with self._lock:
+            if summary is None:
+                self.fallback_misses += 1
+                return None
+            self.fallbacks += 1
+        return summary.route_id, replay_summary(summary.id, summary.description)
+
+    def count_round(self):
+        with self._lock:
+            self.rounds += 1
+
+    def count_hint_request(self, ready):
+        with self._lock:
+            self.hint_requests += 1
+            self.hints_pending += not ready
+
+    def stats(self):
+        with self._lock:
+            return {
+                'replays': self.replays,
+                'generations': self.generations,
+                'in_flight': len(self.flights),
+                'followers': self.followers,
+                'failures': self.failures,
+                'cancellations': self.cancellations,
+                'hints': self.hints,
+                'hint_failures': self.hint_failures,
+                'hint_requests': self.hint_requests,
+                'hint_ready_rate': 1 - self.hints_pending / self.hint_requests if self.hint_requests else None,
+                'rounds': self.rounds,
+                'fallbacks': self.fallbacks,
+                'fallback_misses': self.fallback_misses,
+                'fallback_rate': self.fallbacks / self.rounds if self.rounds else None,
+                'max_age_days': self.max_age_days,
+                'variants': self.variants,
+            }
+
+
+legendary_lines_content = LegendaryLinesContent(
+    max_age_days=int(os.getenv('LL_CONTENT_MAX_AGE_DAYS', 0)),
+    variants=int(os.getenv('LL_CONTENT_VARIANTS', 1)),
+    heartbeat_seconds=int(os.getenv('LL_HEARTBEAT_SECONDS', 15)),
+    replay=os.getenv('LL_CONTENT_REPLAY', '1') == '1',
+)
+# How long a round's hint is reported as pending before it counts as failed
+LL_HINT_PENDING_SECONDS = int(os.getenv('LL_HINT_PENDING_SECONDS', 60))
+
+class RequestBudget:
+    """Token bucket for background model calls: up to `per_minute` calls a minute, refilled continuously"""
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.per_minute, self.tokens + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def take(self, calls):
+        with self._lock:
+            self._refill()
+            if self.tokens < calls:
+                return False
+            self.tokens -= calls
+            return True
+
+    def wait_seconds(self, calls):
+        """How long until `calls` calls fit in the budget"""
+        if self.per_minute <= 0:
+            return float('inf')
+        with self._lock:
+            self._refill()
+            return max(0.0, (calls - self.tokens) * 60 / self.per_minute)
+
+class LegendaryLinesPool:
+    """Per-area queues of ready Legendary Lines rounds, (route_id, summary_id, description), so starting a round
+    is a pop instead of two model calls. A background thread keeps every area topped up: rounds come from stored
+    summaries when the regeneration policy allows, otherwise from new generations paid for out of the request
+    budget. ResourceExhausted backs the thread off exponentially."""
+    CALLS_PER_ROUND = 2     # description and hint
+
+    def __init__(self, depth=3, requests_per_minute=10, backoff_seconds=30, max_backoff_seconds=1800):
+        self.depth = depth
+        self.budget = RequestBudget(requests_per_minute)
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.rounds = {}
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.exhausted = 0
+        self.backoff_until = 0
+        self._backoff = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def pop(self, area_id):
+        if self.depth <= 0:
+            return None
+
+        self.start()
+        with self._lock:
+            rounds = self.rounds.get(area_id)
+            found = rounds.popleft() if rounds else None
+            if found is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        self._wake.set()
+        return found
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="legendary-lines-pool", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        with app.app_context():
+            area_ids = [area_id for area_id, in db.session.query(MpDescriptions.area_id).distinct()
+                        if area_id is not None]
+        with self._lock:
+            for area_id in area_ids:
+                self.rounds.setdefault(area_id, deque())
+
+        while True:
+            wait = 60
+            try:
+                with app.app_context():
+                    wait = self.refill()
+            except Exception as err:
+                logging.error(f"Legendary Lines pool refill failed: {err}")
+            self._wake.wait(timeout=wait)
+            self._wake.clear()
+
+    def refill(self):
+        """Tops up every area it can; returns how long to sleep before trying again"""
+        wait = 60
+        with self._lock:
+            area_ids = [area_id for area_id, rounds in self.rounds.items() if len(rounds) < self.depth]
+
+        for area_id in area_ids:
+            while True:
+                if time.time() < self.backoff_until:
+                    return self.backoff_until - time.time()
+                with self._lock:
+                    if len(self.rounds[area_id]) >= self.depth:
+                        break
+                found = self.next_round(area_id)
+                if found is None:
+                    if llm_provider.circuit_open():
+                        wait = min(wait, max(1.0, llm_provider.breaker.retry_in()))
+                    else:
+                        wait = min(wait, self.budget.wait_seconds(self.CALLS_PER_ROUND))
+                    break
+                with self._lock:
+                    self.rounds[area_id].append(found)
+        return wait
+
+    def next_round(self, area_id):
+        from random import choice
+
+        candidates = db.session.query(MpDescriptions.id, MpDescriptions.route_id).filter_by(area_id=area_id).all()
+        if not candidates:
+            return None
+        description_id, route_id = choice(candidates)
+
+        summaries = legendary_lines_content.stored(route_id)
+        fresh = legendary_lines_content.fresh(summaries)
+        if (len(fresh) < legendary_lines_content.variants and not llm_provider.circuit_open()
+                and self.budget.take(self.CALLS_PER_ROUND)):
+            return self.generate(route_id, description_id)
+        if summaries:
+            summary = choice(fresh or summaries)
+            return route_id, summary.id, summary.description
+        return None
+
+    def generate(self, route_id, description_id):
+        flight = legendary_lines_content.flight_for(db.session.get(MpDescriptions, description_id))
+        summary_id = None
+        description = ''
+        failed = False
+        for kind, chunk in flight.follow():
+            if kind == 'round':
+                summary_id = chunk
+            elif kind == 'text':
+                description += chunk
+            elif kind == 'failed':
+                failed = True
+
+        if flight.exhausted:
+            with self._lock:
+                self.exhausted += 1
+                self._backoff = min(self.max_backoff_seconds, max(self.backoff_seconds, self._backoff * 2))
+                self.backoff_until = time.time() + self._backoff
+            logging.warning(f"Legendary Lines pool backing off {self._backoff}s after ResourceExhausted")
+            return None
+        if failed or not (summary_id and description):
+            return None
+        with self._lock:
+            self._backoff = 0
+            self.generated += 1
+        return route_id, summary_id, description
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'depth': self.depth,
+                'queue_depth': {str(area_id): len(rounds) for area_id, rounds in self.rounds.items()},
+                'rounds_ready': sum(len(rounds) for rounds in self.rounds.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else None,
+                'generated': self.generated,
+                'exhausted': self.exhausted,
+                'backoff_seconds': max(0, round(self.backoff_until - time.time())),
+                'budget_per_minute': self.budget.per_minute,
+            }
+
+
+legendary_lines_pool = LegendaryLinesPool(
+    depth=int(os.getenv('LL_POOL_DEPTH', 3)),
+    requests_per_minute=int(os.getenv('LL_POOL_REQUESTS_PER_MINUTE', 10)),
+    backoff_seconds=int(os.getenv('LL_POOL_BACKOFF_SECONDS', 30)),
+    max_backoff_seconds=int(os.getenv('LL_POOL_MAX_BACKOFF_SECONDS', 1800)),
+)
+
+class RouteSearchPayloads:
+    """Per-area /api/ll/search responses, serialized and gzipped once with a strong ETag. mp_descriptions only
+    changes when the constructor script runs, so each area is rebuilt only when its row count or highest id
+    moves, checked at most every `revalidate_seconds`"""
+    def __init__(self, revalidate_seconds=300):
+        self.revalidate_seconds = revalidate_seconds
+        self.payloads = {}
+        self.builds = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(area_id):
+        count, max_id = (db.session.query(func.count(MpDescriptions.id), func.max(MpDescriptions.id))
+                         .filter(MpDescriptions.area_id == area_id).one())
+        return count, max_id
+
+    def build(self, area_id, fingerprint):
+        import gzip
+        import hashlib
+
+        rows = [route.to_dict() for route in MpDescriptions.query.filter_by(area_id=area_id).order_by(MpDescriptions.id)]
+        try:
+            body = json.dumps(rows, separators=(',', ':'), allow_nan=False)
+            valid = rows
+        except (TypeError, ValueError):
+            # Drop the rows the browser couldn't parse (NaN lengths from the scraper) rather than the whole area
+            valid = []
+            for row in rows:
+                try:
+                    json.dumps(row, allow_nan=False)
+                    valid.append(row)
+                except (TypeError, ValueError) as err:
+                    logging.warning(f"Skipping route {row['route_name']} in search payload: {err}")
+            body = json.dumps(valid, separators=(',', ':'))
+        body = body.encode()
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        payload = {
+            'fingerprint': fingerprint,
+            'checked_at': time.time(),
+            'etag': etag,
+            'body': body,
+            'gzip': gzip.compress(body, compresslevel=9, mtime=0),
+            'rows': valid,
+            'index': None,
+        }
+        with self._lock:
+            self.payloads[area_id] = payload
+            self.builds += 1
+        return payload
+
+    def get(self, area_id):
+        with self._lock:
+            payload = self.payloads.get(area_id)
+        if payload is not None and time.time() - payload['checked_at'] < self.revalidate_seconds:
+            return payload
+
+        fingerprint = self.fingerprint(area_id)
+        if payload is not None and payload['fingerprint'] == fingerprint:
+            payload['checked_at'] = time.time()
+            return payload
+        return self.build(area_id, fingerprint)
+
+    def index(self, area_id):
+        """The area's trigram index for ?q= searches, built on first use and rebuilt along with the payload"""
+        payload = self.get(area_id)
+        if payload['index'] is None:
+            payload['index'] = route_search.TrigramIndex(payload['rows'])
+        return payload['index']
+
+    def stats(self):
+        with self._lock:
+            return {
+                'areas': len(self.payloads),
+                'builds': self.builds,
+                'bytes': sum(len(payload['body']) for payload in self.payloads.values()),
+                'gzip_bytes': sum(len(payload['gzip']) for payload in self.payloads.values()),
+            }
+
+
+route_search_payloads = RouteSearchPayloads(revalidate_seconds=int(os.getenv('LL_SEARCH_REVALIDATE_SECONDS', 300)))
+
+SSE_MARKERS = {'done': '[DONE]', 'error': '[ERROR]'}
+
+def stream_legendary_lines_round(area_id):
+    """(route_id, events) for a new round: a pooled round when one is ready, otherwise a random route in the
+    area streamed through the content cache, falling back to any stored round in the area when that route
+    can't be generated. None when there is nothing to serve"""
+    from random import choice
+
+    legendary_lines_content.count_round()
+    pooled = legendary_lines_pool.pop(area_id)
+    if pooled is not None:
+        route_id, summary_id, description = pooled
+        return route_id, replay_summary(summary_id, description)
+
+    all_routes_in_area = MpDescriptions.query.filter_by(area_id=area_id).all()
+    if not all_routes_in_area:
+        return None
+    route = choice(all_routes_in_area)
+    logging.debug(f"route: {route.route_name}")
+    events = legendary_lines_content.stream(route)
+    if events is None:
+        return legendary_lines_content.fallback(area_id)
+    return route.route_id, events
+
+class StreamLimiter:
+    """Caps the Legendary Lines streams one process holds open, so they can't take every worker thread the
+    daily pages need"""
+    def __init__(self, limit=100):
+        self.limit = limit
+        self.open = 0
+        self.peak = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.open >= self.limit:
+                self.rejected += 1
+                return False
+            self.open += 1
+            self.peak = max(self.peak, self.open)
+            return True
+
+    def release(self):
+        with self._lock:
+            self.open -= 1
+
+    def stats(self):
+        with self._lock:
+            return {'open': self.open, 'peak': self.peak, 'limit': self.limit, 'rejected': self.rejected}
+
+
+ll_streams = StreamLimiter(limit=int(os.getenv('LL_MAX_STREAMS', 100)))
+LL_STREAM_RETRY_MS = 5000
+
+def generate_legendary_lines(area_id):
+    if not ll_streams.acquire():
+        # EventSource reconnects by itself after `retry` once the stream ends
+        yield f"retry: {LL_STREAM_RETRY_MS}\n\n"
+        return
+
+    try:
+        next_round = stream_legendary_lines_round(area_id)
+        # Only the fallback below touches the database again; an open stream must not hold a pooled connection
+        db.session.close()
+
+        while next_round is not None:
+            route_id, events = next_round
+            next_round = None
+            # A second ROUTE_ID tells the page to drop what it has shown and start over
+            yield f"data: ROUTE_ID:{route_id}\n\n"
+            for kind, chunk in events:
+                if kind == 'heartbeat':
+                    # A comment line: keeps proxies from timing the stream out, and a write to a client that has
+                    # gone raises here, which closes the stream and lets the generation be cancelled
+                    yield ": heartbeat\n\n"
+                elif kind == 'text':
+                    yield sse_data(chunk)
+                elif kind == 'round':
+                    yield sse_data(f"ROUND_ID:{chunk}")
+                elif kind == 'failed':
+                    next_round = legendary_lines_content.fallback(area_id)
+                    db.session.close()
+                    break
+                else:
+                    yield sse_data(SSE_MARKERS[kind])
+                    if kind == 'done':
+                        return
+        # Ending without [DONE] would only make EventSource reconnect into the same failure
+        yield sse_data(SSE_MARKERS['error'])
+    finally:
+        ll_streams.release()
 
 
 
 # ======================= FLASK DECORATORS =======================
 
+@app.before_request
+def start_background_jobs():
+    if os.getenv('DAILY_SCHEDULER', '1') == '1':
+        daily_scheduler.start()
+
 @login_manager.user_loader
 def load_user(user_id):
     return db.session.get(User, int(user_id))
@@ -505,7 +2204,7 @@ def home():
     if current_user.is_authenticated:
         attempt = DailyAttempt.query.filter_by(challenge_date=today, user_id = current_user.id).first()
         logging.debug(attempt)
-        if attempt and len(attempt.level_scores) == 5:
+        if attempt and attempt.completed:
             daily_completed = True
 
     return render_template("index.html",
@@ -532,10 +2231,8 @@ def privacy_page():
 @login_required
 def daily():
     today = date.today()
-    daily_data = DailyRouteData.query.filter_by(challenge_date=today).first()
-    if not daily_data:
+    if daily_bundle.get(today) is None:
         generate_daily(entered_date=today)
-        daily_data = DailyRouteData.query.filter_by(challenge_date=today).first()
 
     attempt = DailyAttempt.query.filter_by(
         user_id=current_user.id,
@@ -571,8 +2268,8 @@ def daily_level(level):
         return redirect(url_for("daily"))
 
     today = date.today()
-    daily_data = DailyRouteData.query.filter_by(challenge_date=today).first()
-    if not daily_data:
+    levels = daily_bundle.get(today)
+    if not levels:
         return redirect(url_for('daily'))
 
     attempt = DailyAttempt.query.filter_by(
@@ -592,21 +2289,19 @@ def daily_level(level):
     elif level > completed_levels + 1:
         return redirect(url_for("daily_level", level = completed_levels + 1))
 
-    level_names = ["one","two","three","four","five"]
-    level_name = level_names[level-1]
-
-    image_id = getattr(daily_data, f"image_{level_name}_id")
-
-    image_url = RouteImage.query.filter_by(id=image_id).first().image_link
+    image_url = image_src(levels[level-1]['image_id'], levels[level-1]['image_link'])
+    next_image_url = image_src(levels[level]['image_id'], levels[level]['image_link']) if level < 5 else None
 
     current_total = attempt.total_score if attempt.total_score else 0
 
-    return render_template("daily_level.html",
-                           level=level,
-                           total_levels=5,
-                           image_url=image_url,
-                           current_total=current_total,
-                           cesium_key=cesium_key)
+    response = app.make_response(render_template("daily_level.html",
+                                                 level=level,
+                                                 total_levels=5,
+                                                 image_url=image_url,
+                                                 current_total=current_total,
+                                                 preload_hints=preload_hints_enabled,
+                                                 cesium_key=cesium_key))
+    return add_level_hints(response, image_url, next_image_url)
 
 @app.route("/daily/level/<int:level>/results")
 @login_required
@@ -617,19 +2312,13 @@ def level_results(level):
     if not attempt:
         return redirect(url_for("daily"))
 
-    daily_data = DailyRouteData.query.filter_by(challenge_date=today).first()
-    if not daily_data:
+    levels = daily_bundle.get(today)
+    if not levels:
         return redirect(url_for('daily'))
 
     level_idx0 = level - 1
-    level_names = ["one","two","three","four","five"]
-    level_name = level_names[level-1]
-
-    route_id = getattr(daily_data, f"route_{level_name}_id")
-    image_id = getattr(daily_data, f"image_{level_name}_id")
-
-    image_url = RouteImage.query.filter_by(id=image_id).first().image_link
-    route = ClimbingRoute.query.filter_by(id=route_id).first()
+    route = levels[level_idx0]
+    image_url = image_src(route['image_id'], route['image_link'])
 
     # Attempt data to render
     score = attempt.level_scores[level_idx0]
@@ -639,14 +2328,14 @@ def level_results(level):
     total_score = attempt.total_score
 
     # Route data to render
-    route_name = route.route_name
-    route_link = route.route_link
-    route_lat = route.route_lat
-    route_lon = route.route_lon
-    route_type = route.route_type
-    route_grade = route.route_grade
-    route_stars = route.route_stars
-    route_length = int(route.route_length)
+    route_name = route['route_name']
+    route_link = route['route_link']
+    route_lat = route['route_lat']
+    route_lon = route['route_lon']
+    route_type = route['route_type']
+    route_grade = route['route_grade']
+    route_stars = route['route_stars']
+    route_length = int(route['route_length'])
 
     # Calculation data to render
     if distance >= 1:
@@ -657,33 +2346,13 @@ def level_results(level):
     avg_lat = (lat_guess + route_lat) / 2
     avg_lon = (lon_guess + route_lon) / 2
 
-    # Area name finder
-    area_name = ClimbingArea.query.filter_by(id=route.area_id).first().area_name
-
-    if route_type == "TR":
-        route_type_str = "Top Rope"
-    elif route_type == "Trad":
-        route_type_str = "Trad Climb"
-    elif route_type == "Sport":
-        route_type_str = "Sport Climb"
-    elif route_type == "Boulder":
-        route_type_str = "Boulder"
-    else:
-        route_type_str = "Unknown"
-
-    stars = int(route_stars)
-    if stars == 0:
-        stars = "💣"
-    elif stars <= 1.6:
-        stars = "★☆☆☆"
-    elif stars <= 2.6:
-        stars = "★★☆☆"
-    elif stars <= 3.6:
-        stars = "★★★☆"
-    else:
-        stars = "★★★★"
+    area_name = route['area_name']
+
+    calc = Calculations()
+    route_type_str = calc.get_route_type_str(route_type)
+    stars = calc.get_stars_str(route_stars)
 
-    zoom = Calculations().find_cesium_zoom(distance)
+    zoom = calc.find_cesium_zoom(distance)
     if zoom <= 3500:
         zoom = 3500
 
@@ -721,42 +2390,25 @@ def daily_results():
     if not attempt or len(attempt.level_scores) < 5:
         return redirect(url_for("daily"))
 
-    daily_data = DailyRouteData.query.filter_by(
-        challenge_date=today
-    ).options(
-        db.joinedload(DailyRouteData.route_one).joinedload(ClimbingRoute.climbing_area),
-        db.joinedload(DailyRouteData.route_two).joinedload(ClimbingRoute.climbing_area),
-        db.joinedload(DailyRouteData.route_three).joinedload(ClimbingRoute.climbing_area),
-        db.joinedload(DailyRouteData.route_four).joinedload(ClimbingRoute.climbing_area),
-        db.joinedload(DailyRouteData.route_five).joinedload(ClimbingRoute.climbing_area),
-        db.joinedload(DailyRouteData.image_one),
-        db.joinedload(DailyRouteData.image_two),
-        db.joinedload(DailyRouteData.image_three),
-        db.joinedload(DailyRouteData.image_four),
-        db.joinedload(DailyRouteData.image_five)
-    ).first()
-
-    if not daily_data:
+    levels = daily_bundle.get(today)
+    if not levels:
         return redirect(url_for("daily"))
 
     level_data = {}
-    level_names = ["one", "two", "three", "four", "five"]
     calc = Calculations()
     for i in range(1, 6):
-        level_name = level_names[i - 1]
-        route = getattr(daily_data, f"route_{level_name}")
-        image = getattr(daily_data, f"image_{level_name}")
+        route = levels[i - 1]
         level_data[str(i)] = {
-            'route_name': route.route_name.upper(),
-            'route_link': route.route_link,
-            'route_grade': route.route_grade,
-            'route_type': route.route_type,
-            'route_stars': route.route_stars,
-            'route_length': int(route.route_length),
-            'route_lat': route.route_lat,
-            'route_lon': route.route_lon,
-            'area_name': route.climbing_area.area_name,
-            'image_link': image.image_link,
+            'route_name': route['route_name'].upper(),
+            'route_link': route['route_link'],
+            'route_grade': route['route_grade'],
+            'route_type': route['route_type'],
+            'route_stars': route['route_stars'],
+            'route_length': int(route['route_length']),
+            'route_lat': route['route_lat'],
+            'route_lon': route['route_lon'],
+            'area_name': route['area_name'],
+            'image_link': image_src(route['image_id'], route['image_link']),
             'score': attempt.level_scores[i - 1],
             'distance': attempt.distance[i - 1],
             'guess_lat': attempt.lat_guess[i - 1],
@@ -777,20 +2429,66 @@ def daily_results():
 def daily_leaderboard():
     today = date.today()
 
-    from sqlalchemy.orm import joinedload
-    leaderboard = (DailyAttempt.query.filter_by(
-        challenge_date=today
-    ).filter(
-        DailyAttempt.level_scores.isnot(None),
-        db.func.json_array_length(DailyAttempt.level_scores) == 5
+    page = request.args.get('page', default=1, type=int)
+    user_rank = None
+    if current_user.is_authenticated:
+        user_rank = daily_leaderboard_service.rank_of(today, current_user.id)
+        if request.args.get('around') == 'me' and user_rank is not None:
+            page = daily_leaderboard_service.page_of(user_rank)
+
+    leaderboard, page, total_pages, total_players = daily_leaderboard_service.page(today, page)
+
+    return render_template("leaderboard.html",
+                           leaderboard=leaderboard,
+                           page=page,
+                           total_pages=total_pages,
+                           total_players=total_players,
+                           user_rank=user_rank,
+                           date=today,
+                           current_user=current_user)
+
+
+@app.route("/leaderboard/<period>")
+def period_leaderboard(period):
+    periods = {'weekly': 'week', 'monthly': 'month', 'all-time': 'all'}
+    if period not in periods:
+        return redirect(url_for("daily_leaderboard"))
+
+    today = date.today()
+    rollup_period = periods[period]
+    period_start = UserScoreRollup.period_start_for(rollup_period, today)
+    page_size = daily_leaderboard_service.page_size
+    page = max(request.args.get('page', default=1, type=int), 1)
+
+    rollups = UserScoreRollup.query.filter_by(
+        period=rollup_period,
+        period_start=period_start
     ).options(
-        joinedload(DailyAttempt.user)
+        db.joinedload(UserScoreRollup.user)
     ).order_by(
-        DailyAttempt.total_score.desc()
-    ).all())
+        UserScoreRollup.total_score.desc(), UserScoreRollup.id
+    ).offset((page - 1) * page_size).limit(page_size + 1).all()
+
+    has_next = len(rollups) > page_size
+    leaderboard = []
+    for i, rollup in enumerate(rollups[:page_size]):
+        leaderboard.append({
+            'rank': (page - 1) * page_size + i + 1,
+            'user_id': rollup.user_id,
+            'username': rollup.user.username,
+            'days_played': rollup.days_played,
+            'best_score': rollup.best_score,
+            'average_score': int(round(rollup.average_score)),
+            'total_score': rollup.total_score,
+        })
 
     return render_template("leaderboard.html",
                            leaderboard=leaderboard,
+                           period=period,
+                           period_start=period_start,
+                           page=page,
+                           total_pages=page + 1 if has_next else page,
+                           user_rank=None,
                            date=today,
                            current_user=current_user)
 
@@ -799,163 +2497,93 @@ def daily_leaderboard():
 
 @app.route("/free-play/<path:area_names>")
 def free_play(area_names):
-    # area_names can be a single area or comma-separated list of areas
-    # e.g., "/free-play/RedRocks" or "/free-play/RedRocks,Yosemite,JTree"
-    area_names_list = [name.strip() for name in area_names.split(',')]
-
-    data = generate_free_play(area_names_list)
-    next_level = 1
+    # area_names is a single area id or a comma-separated list of them, e.g. "/free-play/3" or "/free-play/3,7"
+    try:
+        area_ids = [int(name.strip()) for name in area_names.split(',')]
+    except ValueError:
+        abort(400)
+    if not route_index.known(area_ids):
+        abort(400)
 
-    session['data'] = data
-    session['level_scores'] = []
-    session['guesses_lat'] = []
-    session['guesses_lon'] = []
-    session['distances'] = []
-    session['level'] = next_level
-    session['total_score'] = 0
-    session['result_info'] = []
+    game = FreePlayGame.from_data(free_play_pool.pop(area_ids))
+    game_id = secrets.token_urlsafe(12)
+    free_play_store.put(game_id, game)
+    session['game_id'] = game_id
 
-    return redirect(url_for("free_play_level", level=next_level))
+    return redirect(url_for("free_play_level", level=1))
 
-@app.route("/free-play/level/<level>")
+@app.route("/free-play/level/<int:level>")
 def free_play_level(level):
-    # if not session.get('level_scores'):
-    #     return redirect(url_for("free_play"))
-    #
-    # if not session.get('data'):
-    #     return redirect(url_for("free_play"))
-    #
-    # if level != session.get('level'):
-    #     return redirect(url_for("free_play_level", level=session.get('level')))
-    #
-    # if level > 5:
-    #     return redirect(url_for("free_play_final_results"))
-
-    # Structured like this data = {'area_ids': area_ids, 'route_ids': route_ids, 'img_ids': img_ids}
-    data = session['data']
-    image_id = data['img_ids'][int(level) - 1]
-    image_url = RouteImage.query.filter_by(id=image_id).first().image_link
-
-    # Get base coordinates - if multiple areas (None), calculate from the specific area
-    base_lat = data.get('area_lat')
-    base_lon = data.get('area_lon')
-    zoom_level = data.get('zoom')
-
-
-    total_score = session['total_score']
-    logging.debug(session)
-    return render_template("free_level.html",
-                           base_lat = base_lat,
-                           base_lon = base_lon,
-                           image_url=image_url,
-                           zoom_level=zoom_level,
-                           total_levels=5,
-                           level=level,
-                           current_total=total_score,
-                           cesium_key=cesium_key)
+    game_id, game = current_free_play_game()
+    if game is None:
+        return redirect(url_for("free_play_select"))
+    if level < 1 or level > FreePlayGame.levels:
+        return redirect(url_for("free_play_level", level=min(game.levels_played + 1, FreePlayGame.levels)))
+
+    image_ids = game.img_ids[level - 1:level + 1]
+    images = dict(db.session.query(RouteImage.id, RouteImage.image_link).filter(RouteImage.id.in_(image_ids)).all())
+    image_url = image_src(image_ids[0], images[image_ids[0]])
+    next_image_url = image_src(image_ids[1], images[image_ids[1]]) if len(image_ids) > 1 else None
+
+    response = app.make_response(render_template("free_level.html",
+                                                 base_lat = game.area_lat,
+                                                 base_lon = game.area_lon,
+                                                 image_url=image_url,
+                                                 zoom_level=game.zoom,
+                                                 total_levels=5,
+                                                 level=level,
+                                                 current_total=game.total_score,
+                                                 preload_hints=preload_hints_enabled,
+                                                 cesium_key=cesium_key))
+    return add_level_hints(response, image_url, next_image_url)
 
 @app.route("/free-play/level/<int:level>/results")
 def free_play_results(level):
-    if not session:
-        return redirect(url_for("free_play"))
-
-    if len(session['level_scores']) != level:
-        # TODO
-        return redirect(url_for("free_play_level", level=level))
-    data = session['data']
-    image_id = data['img_ids'][int(level) - 1]
-    route_id = data['route_ids'][int(level) - 1]
-    area_id = data['area_ids'][int(level) - 1]
-
-    image_info = RouteImage.query.filter_by(id=image_id).first()
-    route_info = ClimbingRoute.query.filter_by(id=route_id).first()
-    area_info = ClimbingArea.query.filter_by(id=area_id).first()
-
-    logging.debug(session)
-    distance = session['distances'][int(level) - 1]
-    user_lon = session['guesses_lon'][int(level) - 1]
-    user_lat = session['guesses_lat'][int(level) - 1]
+    game_id, game = current_free_play_game()
+    if game is None:
+        return redirect(url_for("free_play_select"))
+
+    if level < 1 or level > game.levels_played:
+        return redirect(url_for("free_play_level", level=min(game.levels_played + 1, FreePlayGame.levels)))
+
+    image_info = RouteImage.query.filter_by(id=game.img_ids[level - 1]).first()
+    route_info = ClimbingRoute.query.filter_by(id=game.route_ids[level - 1]).first()
+    area_info = ClimbingArea.query.filter_by(id=game.area_ids[level - 1]).first()
+
+    distance = game.distances[level - 1]
+    user_lon = game.guesses_lon[level - 1]
+    user_lat = game.guesses_lat[level - 1]
 
     if distance >= 1:
         distance_str = f"{distance:.2f} km"
     else:
         distance_str = f"{distance*1000:.2f} m"
 
-    route_lat = route_info.route_lat
-    route_lon = route_info.route_lon
-
-    avg_lat = (user_lat + route_lat) / 2
-    avg_lon = (user_lon + route_lon) / 2
-
-    score = session['level_scores'][int(level) - 1]
-    total_score = session['total_score']
+    avg_lat = (user_lat + route_info.route_lat) / 2
+    avg_lon = (user_lon + route_info.route_lon) / 2
 
-    if route_info.route_type == "TR":
-        route_type_str = "Top Rope"
-    elif route_info.route_type == "Trad":
-        route_type_str = "Trad Climb"
-    elif route_info.route_type == "Sport":
-        route_type_str = "Sport Climb"
-    elif route_info.route_type == "Boulder":
-        route_type_str = "Boulder"
-    else:
-        route_type_str = "Unknown"
-
-    stars = int(route_info.route_stars)
-    if stars == 0:
-        stars = "💣"
-    elif stars <= 1.6:
-        stars = "★☆☆☆"
-    elif stars <= 2.6:
-        stars = "★★☆☆"
-    elif stars <= 3.6:
-        stars = "★★★☆"
-    else:
-        stars = "★★★★"
-
-    zoom = Calculations().find_cesium_zoom(distance)
+    calc = Calculations()
+    zoom = calc.find_cesium_zoom(distance)
     if zoom <= 3500:
         zoom = 3500
     logging.debug(f"Zoom height (in meters): {zoom}")
 
-    result_info = session['result_info']
-    result_info.append({
-        'route_name': route_info.route_name,
-        'route_grade': route_info.route_grade,
-        'route_length': route_info.route_length,
-        'route_type': route_info.route_type,
-        'route_stars': route_info.route_stars,
-        'route_link': route_info.route_link,
-        'area_name': area_info.area_name,
-        'stars_str': stars,
-        'type_str': route_type_str,
-        'img_url': image_info.image_link
-    })
-    session['result_info'] = result_info
-
-    logging.debug(f"Session info: {session['result_info']}")
-    logging.debug(f"Data: {session['data']}")
-    logging.debug(f"Total Score: {session['total_score']}")
-    logging.debug(f"Distances: {session['distances']}")
-    logging.debug(f"Scores: {session['level_scores']}")
-    logging.debug(f"Test: {session['result_info'][int(level) - 1]}")
-
     return render_template("free_result.html",
                            level=level,
                            cesium_key=cesium_key,
                            total_levels=5,
-                           image_url = image_info.image_link,
-                           score = score,
+                           image_url = image_src(image_info.id, image_info.image_link),
+                           score = game.scores[level - 1],
                            user_lat = user_lat,
                            user_lon = user_lon,
-                           distance = session['distances'][int(level) - 1],
-                           current_total = total_score,
+                           distance = distance,
+                           current_total = game.total_score,
                            route_name = route_info.route_name.upper(),
                            route_link = route_info.route_link,
-                           route_type = route_type_str,
+                           route_type = calc.get_route_type_str(route_info.route_type),
                            route_grade = route_info.route_grade,
                            route_stars = route_info.route_stars,
-                           stars = stars,
+                           stars = calc.get_stars_str(route_info.route_stars),
                            route_length = route_info.route_length,
                            route_lat = route_info.route_lat,
                            route_lon = route_info.route_lon,
@@ -968,38 +2596,41 @@ def free_play_results(level):
 @app.route('/free-play/results')
 @login_required
 def free_play_end():
-    if not session:
-        return redirect(url_for("free_play"))
+    game_id, game = current_free_play_game()
+    if game is None:
+        return redirect(url_for("free_play_select"))
 
-    if len(session['level_scores']) != 5:
-        # TODO
-        return redirect(url_for("free_play"))
+    if game.levels_played != FreePlayGame.levels:
+        return redirect(url_for("free_play_level", level=game.levels_played + 1))
 
+    routes = {route.id: route for route in ClimbingRoute.query.filter(ClimbingRoute.id.in_(game.route_ids)).options(
+        db.joinedload(ClimbingRoute.climbing_area))}
+    images = {image.id: image for image in RouteImage.query.filter(RouteImage.id.in_(game.img_ids))}
 
     calc = Calculations()
     level_data = {}
     for i in range(1, 6):
-        logging.debug(f"TESTING: {session['result_info'][i-1]}")
+        route = routes[game.route_ids[i - 1]]
         level_data[str(i)] = {
-            'route_name': session['result_info'][i-1]['route_name'],
-            'route_link': session['result_info'][i-1]['route_link'],
-            'route_grade': session['result_info'][i-1]['route_grade'],
-            'route_type': session['result_info'][i-1]['route_type'],
-            'route_stars': session['result_info'][i-1]['route_stars'],
-            'route_length': int(session['result_info'][i-1]['route_length']),
-            'area_name': session['result_info'][i-1]['area_name'],
-            'image_link': session['result_info'][i-1]['img_url'],
-            'score': session['level_scores'][i-1],
-            'score_class': calc.get_score_class(session['level_scores'][i - 1]),
-            'stars_str': session['result_info'][i-1]['stars_str'],
-            'type_str': session['result_info'][i-1]['type_str'],
-            'distance': session['distances'][i-1]
+            'route_name': route.route_name,
+            'route_link': route.route_link,
+            'route_grade': route.route_grade,
+            'route_type': route.route_type,
+            'route_stars': route.route_stars,
+            'route_length': int(route.route_length),
+            'area_name': route.climbing_area.area_name,
+            'image_link': image_src(game.img_ids[i - 1], images[game.img_ids[i - 1]].image_link),
+            'score': game.scores[i - 1],
+            'score_class': calc.get_score_class(game.scores[i - 1]),
+            'stars_str': calc.get_stars_str(route.route_stars),
+            'type_str': calc.get_route_type_str(route.route_type),
+            'distance': game.distances[i - 1]
         }
-    total_score = session['total_score']
+    total_score = game.total_score
     total_score_class = calc.get_total_class(total_score)
     return render_template("free_end.html",
                            user=current_user,
-                           total_score=session['total_score'],
+                           total_score=total_score,
                            total_score_class=total_score_class,
                            level_data=level_data)
 
@@ -1031,28 +2662,32 @@ def legendary_lines_level(area_id):
 @app.route("/api/submit-free-play", methods=["POST"])
 def submit_free_play():
     json = request.get_json()
-    level = json['level']
     guess_lat = json.get('guess_lat')
     guess_lon = json.get('guess_lon')
 
+    game_id, game = current_free_play_game()
+    if game is None:
+        return jsonify({'success': False, 'error': 'No free play game in progress'}), 404
+    level = level_from_request(json, 'free-play', game_id)
+    if level is None:
+        return jsonify({'success': False, 'error': 'Invalid level token'}), 400
+
     # Check if this level has already been completed
-    if len(session['level_scores']) >= int(level):
+    if game.levels_played >= level:
         # Level already completed, return existing score
         return jsonify({
             'success': True,
-            'score': session['level_scores'][int(level) - 1],
-            'distance': session['distances'][int(level) - 1],
-            'total_score': session['total_score']
+            'score': game.scores[level - 1],
+            'distance': game.distances[level - 1],
+            'total_score': game.total_score
         })
-
-    session['guesses_lat'].append(guess_lat)
-    session['guesses_lon'].append(guess_lon)
+    if level != game.levels_played + 1:
+        return jsonify({'success': False, 'error': f'Level {game.levels_played + 1} is next'}), 400
+    if guess_lat is None or guess_lon is None:
+        return jsonify({'success': False, 'error': 'guess_lat and guess_lon are required'}), 400
     logging.debug(f"guess_lat: {guess_lat}, guess_lon: {guess_lon}, level: {level}")
-    logging.debug(session)
 
-
-    data = session['data']
-    route_id = data['route_ids'][int(level) - 1]
+    route_id = game.route_ids[level - 1]
     route_data = ClimbingRoute.query.filter_by(id=route_id).first()
     route_lat, route_lon = route_data.route_lat, route_data.route_lon
 
@@ -1071,19 +2706,14 @@ def submit_free_play():
     score = calc.find_score_daily(distance)
     score = int(round(score))
 
-    session['level_scores'].append(score)
-    distances = session['distances']
-    distances.append(distance)
-    session['distances'] = distances
-
-    # Update total score when guess is submitted, not on results page
-    session['total_score'] = sum(session['level_scores'])
+    game.add_guess(guess_lat, guess_lon, distance, score)
+    free_play_store.put(game_id, game)
 
     return jsonify({
         'success': True,
         'score': int(score),
         'distance': distance,
-        'total_score': session['total_score']
+        'total_score': game.total_score
     })
 
 
@@ -1091,35 +2721,20 @@ def submit_free_play():
 @login_required
 def submit_level():
     json = request.get_json()
-    level = json["level"]
     guess_lat = json.get("guess_lat")
     guess_lon = json.get("guess_lon")
     today = date.today()
+    level = level_from_request(json, 'daily', today.isoformat())
+    if level is None or level < 1 or level > 5:
+        return jsonify({'success': False, 'error': 'Invalid level'}), 400
 
-    # Query Route Data
-    daily_data = DailyRouteData.query.filter_by(challenge_date=today).first()
-    if not daily_data:
+    levels = daily_bundle.get(today)
+    if not levels:
         return redirect(url_for("daily"))
+    route = levels[level-1]
 
-    level_names = ["one","two","three","four","five"]
-    level_name = level_names[level-1]
-
-    route_id = getattr(daily_data, f"route_{level_name}_id")
-    route = ClimbingRoute.query.filter_by(id=route_id).first()
-    if not route:
-        return redirect(url_for("home"))            # TODO
-
-    # Query DailyAttempt
-    attempt = DailyAttempt.query.filter_by(user_id=current_user.id, challenge_date=today).first()
-    if not attempt:
-        return redirect(url_for("home"))            # TODO
-
-    completed_levels = len(attempt.level_scores) if attempt.level_scores else 0
-
-    if level <= completed_levels:
-        return redirect(url_for("level_results", level = level))
-    elif level > completed_levels + 1:
-        return redirect(url_for("daily_level", level = completed_levels + 1))
+    if guess_lat is None or guess_lon is None:
+        return jsonify({'success': False, 'error': 'guess_lat and guess_lon are required'}), 400
 
     # Compute Calculations
     calc = Calculations()
@@ -1129,57 +2744,198 @@ def submit_level():
     }
 
     route_coords = {
-        'route_lat': route.route_lat,
-        'route_lon': route.route_lon
+        'route_lat': route['route_lat'],
+        'route_lon': route['route_lon']
     }
 
     distance = calc.distance_finder(user_coords, route_coords)
     score = calc.find_score_daily(distance)
     score = int(round(score))
 
-    # Query New Data for DB Commit
-    attempt.lat_guess.append(guess_lat)
-    attempt.lon_guess.append(guess_lon)
-    attempt.level_scores.append(score)
-    attempt.total_score = sum(attempt.level_scores)
-    attempt.distance.append(distance)
+    state = append_daily_guess(current_user.id, today, level, guess_lat, guess_lon, distance, score)
+    if state is None:
+        # Level was already submitted (double click, retry) or is out of order
+        attempt = DailyAttempt.query.filter_by(user_id=current_user.id, challenge_date=today).first()
+        if not attempt:
+            return redirect(url_for("home"))            # TODO
 
-    db.session.commit()
+        completed_levels = len(attempt.level_scores) if attempt.level_scores else 0
+        if level <= completed_levels:
+            return redirect(url_for("level_results", level = level))
+        return redirect(url_for("daily_level", level = completed_levels + 1))
+
+    if state.completed_levels == 5:
+        # The attempt itself is already committed, so a failure here must not turn the guess into an error:
+        # the leaderboard catches up on its next reload and the rebuild-* commands repair the derived tables
+        try:
+            record_completed_daily(today, state, current_user)
+        except Exception:
+            db.session.rollback()
+            logging.exception(f"Failed to record completed daily {state.id} for user {current_user.id}")
 
     return jsonify({
         'success': True,
         'score': int(score),
         'distance': distance,
-        'total_score': attempt.total_score
+        'total_score': state.total_score
+    })
+
+@app.route("/img/<int:image_id>")
+def route_image(image_id):
+    width = request.args.get('w', type=int)
+    image_file, meta = image_cache.open_image(image_id, width)
+    if image_file is None:
+        # Not cached yet, or evicted since: fetch it through the cache from the link in the database
+        image = db.session.get(RouteImage, image_id)
+        if image is None:
+            abort(404)
+        image_file, meta = image_cache.open_image(image_id, width, image.image_link)
+        if image_file is None:
+            return redirect(image.image_link)
+
+    # Reuse the upstream validator when there is one, otherwise the content digest. Not the file's mtime or
+    # size: the cache touches the mtime on every hit to keep its LRU order
+    etag = unquote_etag(meta['etag'])[0] if meta.get('etag') else meta['digest']
+    if meta.get('width'):
+        etag += f"-w{meta['width']}"
+    return send_file(image_file, mimetype=meta['content_type'], etag=etag, last_modified=meta['stored_at'],
+                     max_age=image_cache.revalidate_seconds, conditional=True)
+
+@app.route("/api/game/free-play")
+def free_play_bundle():
+    """The current free-play game in one response: every level's image and token, no answers"""
+    game_id, game = current_free_play_game()
+    if game is None:
+        return jsonify({'success': False, 'error': 'No free play game in progress'}), 404
+
+    images = dict(db.session.query(RouteImage.id, RouteImage.image_link).filter(RouteImage.id.in_(game.img_ids)).all())
+    return jsonify({
+        'success': True,
+        'mode': 'free-play',
+        'levels_played': game.levels_played,
+        'total_score': game.total_score,
+        'levels': [{
+            'level': level,
+            'image_url': image_src(image_id, images[image_id]),
+            'token': make_level_token('free-play', game_id, level),
+        } for level, image_id in enumerate(game.img_ids, start=1)],
+    })
+
+@app.route("/api/game/daily")
+@login_required
+def daily_bundle_api():
+    """Today's daily in one response: every level's image and token, no answers"""
+    today = date.today()
+    levels = daily_bundle.get(today)
+    if not levels:
+        return jsonify({'success': False, 'error': "Today's daily is not ready"}), 404
+
+    attempt = DailyAttempt.query.filter_by(user_id=current_user.id, challenge_date=today).first()
+    return jsonify({
+        'success': True,
+        'mode': 'daily',
+        'levels_played': len(attempt.level_scores or []) if attempt else 0,
+        'total_score': (attempt.total_score or 0) if attempt else 0,
+        'levels': [{
+            'level': level,
+            'image_url': image_src(route['image_id'], route['image_link']),
+            'token': make_level_token('daily', today.isoformat(), level),
+        } for level, route in enumerate(levels, start=1)],
     })
 
-@app.route("/api/ll/stream/<area_id>")
+@app.route("/api/me/stats")
+@login_required
+def my_stats():
+    stats = db.session.get(UserStats, current_user.id)
+    if stats is None:
+        stats = UserStats(days_played=0, total_score=0, current_streak=0, longest_streak=0, best_score=0)
+    return jsonify(stats.to_dict(date.today()))
+
+@app.route("/api/metrics/transition", methods=['POST'])
+def record_transition():
+    """Beacon from a level page once its photo is on screen after the player clicked NEXT"""
+    data = request.get_json(force=True, silent=True) or {}
+    mode = data.get('mode')
+    ms = data.get('ms')
+    if mode not in ('daily', 'free-play') or not isinstance(ms, (int, float)) or not 0 <= ms <= 120000:
+        return jsonify({'success': False, 'error': 'Invalid timing'}), 400
+    transition_timings.record(mode, bool(data.get('hinted')), round(ms))
+    return '', 204
+
+# /api/metrics is for operators only: it needs METRICS_TOKEN as a bearer token and is off while that is unset
+metrics_token = os.getenv('METRICS_TOKEN')
+
+@app.route("/api/metrics")
+def metrics():
+    import hmac
+    if not metrics_token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {metrics_token}"):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401, {'WWW-Authenticate': 'Bearer'}
+    return jsonify({
+        'free_play_pool': free_play_pool.stats(),
+        'image_cache': image_cache.stats(),
+        'level_transitions': transition_timings.stats(),
+        'legendary_lines': legendary_lines_content.stats(),
+        'legendary_lines_pool': legendary_lines_pool.stats(),
+        'legendary_lines_streams': ll_streams.stats(),
+        'llm': llm_provider.stats(),
+        'll_search_payloads': route_search_payloads.stats(),
+        'free_play_store': {
+            'backend': type(free_play_store).__name__,
+            'games': free_play_store.size(),
+            'record_bytes': FreePlayGame.layout.size,
+        },
+    })
+
+@app.route("/api/ll/stream/<int:area_id>")
 def legendary_lines_stream(area_id):
     from flask import stream_with_context, Response
-    return Response(stream_with_context(generate_legendary_lines(area_id)), mimetype='text/event-stream')
-    return 'debug'
-
+    return Response(stream_with_context(generate_legendary_lines(area_id)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route("/api/ll/hint/<int:round_id>")
+def legendary_lines_hint(round_id):
+    """The hint for a round from /api/ll/stream. Written in the background once the description is done, so
+    it is normally there before the player unlocks it; until then this answers 202 and the page retries"""
+    summary = db.session.get(LLMDescriptions, round_id)
+    if summary is None:
+        return jsonify({'success': False, 'error': 'Round not found'}), 404
+    legendary_lines_content.count_hint_request(bool(summary.hint))
+    if summary.hint:
+        response = jsonify({'success': True, 'hint': summary.hint})
+        response.headers['Cache-Control'] = 'private, max-age=3600'
+        return response
+    if datetime.utcnow() - summary.date < timedelta(seconds=LL_HINT_PENDING_SECONDS):
+        return jsonify({'success': False, 'pending': True}), 202, {'Retry-After': '1'}
+    return jsonify({'success': False, 'error': 'No hint for this round'}), 404
 
 @app.route("/api/ll/search")
 def search_routes():
     area_id = request.args.get('area_id', default=0, type=int)
-    top_climbs = MpDescriptions.query.filter_by(area_id=area_id).all()
-
-    # Debug: find the problematic route
-    results = []
-    for i, route in enumerate(top_climbs):
-        try:
-            d = route.to_dict()
-            # Test if it's JSON serializable
-            import json
-            json.dumps(d)
-            results.append(d)
-        except Exception as e:
-            print(f"Problem with route {i}: {route.route_name}")
-            print(f"Error: {e}")
-            print(f"Data: {route.__dict__}")
-
-    return jsonify(results)
+    if 'q' in request.args:
+        limit = min(max(request.args.get('limit', default=10, type=int), 1), 50)
+        return jsonify(route_search_payloads.index(area_id).search(request.args['q'], limit=limit))
+    if 'route_id' in request.args:
+        route = route_search_payloads.index(area_id).get(request.args.get('route_id', type=int))
+        return jsonify([route] if route else [])
+
+    payload = route_search_payloads.get(area_id)
+
+    # gzip and identity are different representations, so they get different strong ETags
+    gzipped = 'gzip' in request.accept_encodings
+    etag = payload['etag'] + ('-gz' if gzipped else '')
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(payload['gzip'] if gzipped else payload['body'], mimetype='application/json')
+        if gzipped:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 # ======================= GOOGLE AUTHENTICATION =======================
 @app.route("/login")
@@ -1232,6 +2988,341 @@ def init_db():
     db.create_all()
     print("Database tables created!")
 
+@app.cli.command("refresh-index")
+def refresh_index():
+    """Build the route index and report what is playable. Running servers pick up scraper changes on their own:
+    the index is rebuilt after ROUTE_INDEX_TTL, or sooner when a request names an area it doesn't know"""
+    route_index.build()
+    print(f"Route index built with {len(route_index.area_routes)} areas, "
+          f"{sum(len(routes) for routes in route_index.area_routes.values())} routes")
+
+@app.cli.command("migrate-completed-flag")
+def migrate_completed_flag():
+    """Add daily_attempts.completed, backfill it from level_scores and create the leaderboard index"""
+    from sqlalchemy import inspect
+
+    columns = [column['name'] for column in inspect(db.engine).get_columns('daily_attempts')]
+    if 'completed' not in columns:
+        db.session.execute(text("ALTER TABLE daily_attempts ADD COLUMN completed BOOLEAN NOT NULL DEFAULT false"))
+        print("Added column daily_attempts.completed")
+
+    backfilled = db.session.execute(text("""
+        UPDATE daily_attempts SET completed = (json_array_length(level_scores) = 5)
+        WHERE level_scores IS NOT NULL AND completed != (json_array_length(level_scores) = 5)
+    """)).rowcount
+    db.session.commit()
+    print(f"Backfilled {backfilled} attempts")
+
+    for index in DailyAttempt.__table__.indexes:
+        index.create(bind=db.engine, checkfirst=True)
+    print("Leaderboard index ready")
+
+@app.cli.command("rebuild-rollups")
+@click.option("--batch-size", default=5000, help="Attempts fetched per round trip while streaming")
+def rebuild_rollups(batch_size):
+    """Recompute every user_score_rollups row from completed daily attempts in one streaming pass"""
+    from sqlalchemy import select, delete, insert
+
+    totals = {}
+    statement = select(DailyAttempt.user_id, DailyAttempt.challenge_date, DailyAttempt.total_score).where(
+        DailyAttempt.completed).execution_options(yield_per=batch_size)
+    attempts = 0
+    for user_id, challenge_date, total_score in db.session.execute(statement):
+        attempts += 1
+        for period in UserScoreRollup.periods:
+            key = (user_id, period, UserScoreRollup.period_start_for(period, challenge_date))
+            rollup = totals.setdefault(key, [0, 0, 0])
+            rollup[0] += total_score
+            rollup[1] += 1
+            rollup[2] = max(rollup[2], total_score)
+
+    db.session.execute(delete(UserScoreRollup))
+    if totals:
+        db.session.execute(insert(UserScoreRollup), [
+            {'user_id': user_id, 'period': period, 'period_start': period_start,
+             'total_score': total, 'days_played': days, 'best_score': best}
+            for (user_id, period, period_start), (total, days, best) in totals.items()
+        ])
+    db.session.commit()
+    print(f"Rebuilt {len(totals)} rollups from {attempts} completed attempts")
+
+@app.cli.command("rebuild-user-stats")
+@click.option("--batch-size", default=5000, help="Attempts fetched per round trip while streaming")
+def rebuild_user_stats(batch_size):
+    """Recompute user_stats from completed daily attempts, one user at a time in date order"""
+    from sqlalchemy import select, delete
+
+    statement = select(DailyAttempt.user_id, DailyAttempt.challenge_date, DailyAttempt.level_scores,
+                       DailyAttempt.distance, DailyAttempt.total_score).where(
+        DailyAttempt.completed).order_by(
+        DailyAttempt.user_id, DailyAttempt.challenge_date).execution_options(yield_per=batch_size)
+
+    db.session.execute(delete(UserStats))
+    stats = None
+    users = 0
+    for row in db.session.execute(statement):
+        if stats is None or stats.user_id != row.user_id:
+            if users % 1000 == 0:
+                # Finished users are written out so the session doesn't grow with the table
+                db.session.flush()
+                db.session.expunge_all()
+            stats = UserStats(user_id=row.user_id, days_played=0, total_score=0, current_streak=0,
+                              longest_streak=0, best_score=0)
+            db.session.add(stats)
+            users += 1
+        stats.add_attempt(row.challenge_date, row.level_scores, row.distance or [], row.total_score)
+    db.session.commit()
+    print(f"Rebuilt stats for {users} users")
+
+@app.cli.command("warm-images")
+@click.option("--days", default=3, help="Number of days, starting today, of dailies to prefetch")
+@click.option("--resize", is_flag=True, help="Also build every fixed-width resize")
+def warm_images(days, resize):
+    """Prefetch the photos of upcoming dailies into the image cache"""
+    fetched = 0
+    for offset in range(days):
+        levels = daily_bundle.build(date.today() + timedelta(days=offset))
+        for level in levels or []:
+            path, _ = image_cache.get(level['image_id'], level['image_link'])
+            if path and resize:
+                for width in ImageCache.widths:
+                    image_cache.get_resized(level['image_id'], width)
+            fetched += path is not None
+    print(f"Warmed {fetched} images, cache is {image_cache.size() / 1024 / 1024:.1f} MB")
+
+@app.cli.command("schedule-daily")
+@click.option("--days", default=7, help="Number of days, starting today, to create")
+def schedule_daily(days):
+    """Create DailyRouteData ahead of time so no /daily request has to generate it"""
+    created = pregenerate_dailies(days)
+    print(f"Created {len(created)} dailies: {', '.join(str(day) for day in created) or 'none needed'}")
+
+@app.cli.command("rescore-daily")
+@click.option("--chunk-size", default=2000, help="Attempts read, rescored and written per batch")
+@click.option("--scale", default=scoring.DAILY_SCALE, type=float, help="Scale of the daily scoring curve")
+@click.option("--checkpoint", default="rescore_daily.checkpoint", help="File holding the last rescored attempt id")
+@click.option("--restart", is_flag=True, help="Ignore the checkpoint and rescore from the first attempt")
+def rescore_daily(chunk_size, scale, checkpoint, restart):
+    """Recompute distance, level_scores and total_score for every DailyAttempt before today in resumable chunks,
+    then rebuild the rollups and user stats derived from them"""
+    import numpy as np
+    from sqlalchemy import select, update
+    from sqlalchemy.orm import aliased
+
+    last_id = 0
+    if not restart and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            last_id = int(f.read().strip() or 0)
+        print(f"Resuming after attempt {last_id}")
+
+    level_names = ["one", "two", "three", "four", "five"]
+    routes = [aliased(ClimbingRoute) for _ in level_names]
+    # Today's attempts are left alone: append_daily_guess may add a level between this job's read and its write,
+    # and writing back the shorter lists would lose that level and stall the attempt
+    statement = select(DailyAttempt.id, DailyAttempt.lat_guess, DailyAttempt.lon_guess,
+                       *[column for route in routes for column in (route.route_lat, route.route_lon)]
+                       ).join(DailyRouteData, DailyRouteData.challenge_date == DailyAttempt.challenge_date
+                       ).where(DailyAttempt.challenge_date < date.today())
+    for route, level_name in zip(routes, level_names):
+        statement = statement.join(route, route.id == getattr(DailyRouteData, f"route_{level_name}_id"))
+
+    rescored = 0
+    while True:
+        # Keyset pagination keeps memory flat and makes every committed chunk a resume point
+        rows = db.session.execute(
+            statement.where(DailyAttempt.id > last_id).order_by(DailyAttempt.id).limit(chunk_size)).all()
+        if not rows:
+            break
+
+        counts, guess_lat, guess_lon, route_lat, route_lon = [], [], [], [], []
+        for row in rows:
+            levels = min(len(row.lat_guess or []), len(row.lon_guess or []))
+            counts.append(levels)
+            guess_lat.extend((row.lat_guess or [])[:levels])
+            guess_lon.extend((row.lon_guess or [])[:levels])
+            route_lat.extend(row[3 + 2 * i] for i in range(levels))
+            route_lon.extend(row[4 + 2 * i] for i in range(levels))
+
+        distances, scores = scoring.score_guesses(guess_lat, guess_lon, route_lat, route_lon, scale=scale)
+        offsets = np.cumsum([0] + counts)
+        updates = []
+        for row, start, end in zip(rows, offsets[:-1], offsets[1:]):
+            level_scores = scores[start:end].tolist()
+            updates.append({
+                'id': row.id,
+                'distance': distances[start:end].tolist(),
+                'level_scores': level_scores,
+                'total_score': sum(level_scores),
+            })
+        db.session.execute(update(DailyAttempt), updates)
+        db.session.commit()
+
+        last_id = rows[-1].id
+        with open(checkpoint + ".tmp", "w") as f:
+            f.write(str(last_id))
+        os.replace(checkpoint + ".tmp", checkpoint)
+        rescored += len(rows)
+        print(f"Rescored {rescored} attempts (through id {last_id})")
+
+    print(f"Done, {rescored} attempts rescored")
+
+    # Period rollups and user stats are maintained incrementally from the scores, so they are rebuilt from the
+    # new ones. Always, not only when this run rescored something: an earlier run may have stopped after its
+    # last chunk
+    click.get_current_context().invoke(rebuild_rollups)
+    click.get_current_context().invoke(rebuild_user_stats)
+
+@app.cli.command("bench-scoring")
+@click.option("--pairs", default=1_000_000, help="Number of guess/route pairs to score")
+@click.option("--check", default=2000, help="Pairs also measured with geopy for accuracy and timing")
+def bench_scoring(pairs, check):
+    """Time and check the vectorized scoring engine against geopy's geodesic"""
+    import numpy as np
+    from geopy.distance import geodesic
+
+    rng = np.random.default_rng(0)
+    lat1, lat2 = rng.uniform(-89, 89, (2, pairs))
+    lon1, lon2 = rng.uniform(-180, 180, (2, pairs))
+
+    start = time.perf_counter()
+    geopy_km = np.array([geodesic((lat1[i], lon1[i]), (lat2[i], lon2[i])).km for i in range(check)])
+    geopy_s = (time.perf_counter() - start) * pairs / check
+    print(f"geopy loop: {geopy_s:.2f} s for {pairs:,} pairs (extrapolated from {check:,})")
+
+    for method in ('ellipsoidal', 'haversine'):
+        start = time.perf_counter()
+        distances = scoring.distances_km(lat1, lon1, lat2, lon2, method=method)
+        scoring.score_daily(distances)
+        elapsed = time.perf_counter() - start
+        error = np.abs(distances[:check] - geopy_km)
+        relative = np.max(error / np.maximum(geopy_km, 1e-9))
+        print(f"{method}: {elapsed:.2f} s ({geopy_s / elapsed:.0f}x), "
+              f"max error {np.max(error) * 1000:.3f} m, max relative error {relative:.4%}")
+
+@app.cli.command("bench-sampler")
+@click.option("--rounds", default=20, help="Games sampled per area and path")
+def bench_sampler(rounds):
+    """Compare per-level ORM queries, the single SQL sampler and the route index, smallest area first"""
+    from random import choice
+
+    def sample_game_orm(area_ids):
+        route_ids, img_ids = [], []
+        for area_id in area_ids:
+            route_id = choice([row.id for row in ClimbingRoute.query.filter_by(area_id=area_id).all()])
+            route_ids.append(route_id)
+            img_ids.append(choice(RouteImage.query.filter_by(route_id=route_id).all()).id)
+        return route_ids, img_ids
+
+    route_index.build()
+    areas = sorted(route_index.area_routes.items(), key=lambda item: len(item[1]))
+    paths = [("orm", sample_game_orm), ("sql", sample_game_sql), ("index", route_index.sample)]
+
+    print(f"{'area':>6} {'routes':>7} " + " ".join(f"{name + ' ms':>10}" for name, _ in paths))
+    for area_id, routes in areas:
+        timings = []
+        for name, sampler in paths:
+            start = time.perf_counter()
+            for _ in range(rounds):
+                sampler([area_id] * 5)
+            timings.append((time.perf_counter() - start) * 1000 / rounds)
+            db.session.rollback()
+        print(f"{area_id:>6} {len(routes):>7} " + " ".join(f"{ms:>10.2f}" for ms in timings))
+
+@app.cli.command("build-prompt-contexts")
+@click.option("--area-id", type=int, default=None, help="Only this area's routes")
+def build_prompt_contexts(area_id):
+    """(Re)build route_prompt_contexts from mp_descriptions and mp_comments, and report prompt sizes. The table
+    is created by `flask init-db`"""
+    query = MpDescriptions.query.order_by(MpDescriptions.id)
+    if area_id is not None:
+        query = query.filter_by(area_id=area_id)
+
+    tokens = []
+    for route in query:
+        tokens.append(build_prompt_context(route).prompt_tokens)
+    if not tokens:
+        print("No described routes")
+        return
+    tokens.sort()
+    print(f"Built {len(tokens)} prompt contexts: prompt tokens min {tokens[0]}, "
+          f"median {tokens[len(tokens) // 2]}, max {tokens[-1]} (estimated)")
+
+@app.cli.command("load-test-streams")
+@click.option("--base-url", default="http://localhost:8000", help="Server under test")
+@click.option("--streams", default=100, help="Legendary Lines clients streaming at once")
+@click.option("--area-id", type=int, default=None, help="Area to stream; defaults to the first described area")
+@click.option("--probe-path", default="/leaderboard", help="Page whose latency should stay flat")
+@click.option("--probes", default=50, help="Requests to the probe page per phase")
+@click.option("--hold", default=20.0, help="Seconds the stream clients keep streaming")
+def load_test_streams(base_url, streams, area_id, probe_path, probes, hold):
+    """Time the probe page alone, then again while `streams` clients keep Legendary Lines streams open. Run the
+    server under gunicorn.conf.py with LLM_PROVIDER=stub, LL_POOL_DEPTH=0 and LL_CONTENT_REPLAY=0 so every
+    stream follows a (stubbed) generation instead of replaying a stored summary"""
+    import requests as http
+
+    if area_id is None:
+        area_id = db.session.query(MpDescriptions.area_id).filter(MpDescriptions.area_id.isnot(None)).first()[0]
+
+    def probe_latencies():
+        latencies = []
+        for _ in range(probes):
+            start = time.perf_counter()
+            http.get(base_url + probe_path, timeout=30)
+            latencies.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.05)
+        return sorted(latencies)
+
+    def summary(latencies):
+        return (f"p50 {latencies[len(latencies) // 2]:.1f} ms, p95 {latencies[int(len(latencies) * 0.95)]:.1f} ms, "
+                f"max {latencies[-1]:.1f} ms")
+
+    results = {'streams': 0, 'rejected': 0, 'errors': 0, 'first_text_ms': []}
+    results_lock = threading.Lock()
+    stop_at = time.time() + hold
+
+    def stream_client():
+        while time.time() < stop_at:
+            start = time.perf_counter()
+            outcome, first_text_ms = 'rejected', None
+            try:
+                with http.get(f"{base_url}/api/ll/stream/{area_id}", stream=True, timeout=60) as response:
+                    for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                        if line.startswith('data: ') and not line.startswith('data: ROUTE_ID:'):
+                            if first_text_ms is None:
+                                first_text_ms = (time.perf_counter() - start) * 1000
+                            outcome = 'streams'
+                        if line.startswith('retry:'):
+                            break
+            except Exception:
+                outcome = 'errors'
+            with results_lock:
+                results[outcome] += 1
+                if first_text_ms is not None:
+                    results['first_text_ms'].append(first_text_ms)
+            if outcome == 'rejected':
+                time.sleep(LL_STREAM_RETRY_MS / 1000)
+
+    print(f"Probing {probe_path} with no streams open...")
+    baseline = probe_latencies()
+    print(f"  {summary(baseline)}")
+
+    print(f"Opening {streams} streams on area {area_id} for {hold:.0f} s...")
+    clients = [threading.Thread(target=stream_client, daemon=True) for _ in range(streams)]
+    for client in clients:
+        client.start()
+    time.sleep(min(2.0, hold / 4))
+    loaded = probe_latencies()
+    print(f"  {summary(loaded)}")
+    for client in clients:
+        client.join()
+
+    first_text = sorted(results['first_text_ms'])
+    print(f"Streams completed: {results['streams']}, "
+          f"rejected at the cap: {results['rejected']}, errors: {results['errors']}")
+    if first_text:
+        print(f"Time to first text: {summary(first_text)}")
+    print(f"Probe p95 changed by {loaded[int(len(loaded) * 0.95)] - baseline[int(len(baseline) * 0.95)]:+.1f} ms")
+
 # ======================= ERROR HANDLING =======================
 
 @app.errorhandler(404)
@@ -244,6 +244,7 @@ document.getElementById('submitButton').addEventListener('click', function() {
         },
         body: JSON.stringify({
             level: LEVEL,
+            token: levelToken || undefined,
             guess_lat: latitude,
             guess_lon: longitude
         })
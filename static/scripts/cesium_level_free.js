@@ -247,6 +247,7 @@ document.getElementById('submitButton').addEventListener('click', function() {
         },
         body: JSON.stringify({
             level: LEVEL,
+            token: levelToken || undefined,
             guess_lat: latitude,
             guess_lon: longitude
         })
@@ -0,0 +1,50 @@
+// Fetches the whole game once, keeps this level's token and warms the browser cache with the next level's photo
+// while the player is still guessing the current one.
+const prefetchedImages = [];
+// This level's opaque token from the bundle. Submits send it once it has loaded, the plain level number before
+let levelToken = null;
+
+function prefetchImage(url) {
+    const img = new Image();
+    img.decoding = 'async';
+    img.src = url;
+    prefetchedImages.push(img);
+}
+
+function prefetchNextLevel(bundleUrl, currentLevel) {
+    fetch(bundleUrl, { credentials: 'same-origin' })
+        .then(response => response.ok ? response.json() : null)
+        .then(bundle => {
+            if (!bundle || !bundle.success) {
+                return;
+            }
+            const current = bundle.levels.find(level => level.level === currentLevel);
+            if (current) {
+                levelToken = current.token;
+            }
+            const next = bundle.levels.find(level => level.level === currentLevel + 1);
+            if (next) {
+                prefetchImage(next.image_url);
+            }
+        })
+        .catch(error => console.debug('Game bundle prefetch failed:', error));
+}
+
+window.addEventListener('load', function() {
+    // Let the current photo and the globe load first
+    setTimeout(() => prefetchNextLevel(GAME_BUNDLE_URL, LEVEL), 500);
+});
+
+// Level-to-level transition time: from NEXT on the results page until this level's photo is on screen.
+// Reported with whether the page was served with preload hints so both can be compared in /api/metrics.
+function reportTransition() {
+    const start = Number(sessionStorage.getItem('levelTransitionStart'));
+    sessionStorage.removeItem('levelTransitionStart');
+    if (!start) {
+        return;
+    }
+    const payload = JSON.stringify({ mode: GAME_MODE, level: LEVEL, hinted: PRELOAD_HINTS, ms: Date.now() - start });
+    navigator.sendBeacon(TRANSITION_METRICS_URL, new Blob([payload], { type: 'application/json' }));
+}
+
+document.getElementById('dynamicImage').addEventListener('load', reportTransition, { once: true });
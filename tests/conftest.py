@@ -0,0 +1,35 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# server.py reads its configuration at import time, so the app under test gets a throwaway SQLite database
+# and image cache, no background scheduler and no real LLM. Set before load_dotenv runs, so a local .env
+# can't point the tests at a real database
+_scratch = tempfile.mkdtemp(prefix="routeguessr-tests-")
+os.environ.update({
+    'NEON_URL': f"sqlite:///{os.path.join(_scratch, 'test.db')}",
+    'FREE_PLAY_STORE_URL': '',
+    'IMAGE_CACHE_DIR': os.path.join(_scratch, 'image_cache'),
+    'DAILY_SCHEDULER': '0',
+    'FREE_PLAY_POOL_PREWARM': '0',
+    'LLM_PROVIDER': 'stub',
+})
+
+
+@pytest.fixture(scope="session")
+def app():
+    import server
+
+    with server.app.app_context():
+        server.db.create_all()
+    server.app.config['TESTING'] = True
+    return server.app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
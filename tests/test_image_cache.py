@@ -0,0 +1,159 @@
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+PHOTO = b"\xff\xd8\xff\xe0 not really a jpeg " * 64
+UPSTREAM_ETAG = '"upstream-v1"'
+
+
+class Upstream(BaseHTTPRequestHandler):
+    """Stand-in for the Mountain Project image host: one photo at any path, honouring If-None-Match"""
+    requests = []
+    delay = None
+
+    def do_GET(self):
+        type(self).requests.append((self.path, self.headers.get('If-None-Match')))
+        if type(self).delay is not None:
+            type(self).delay.wait(5)
+        if self.path.startswith("/missing"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == UPSTREAM_ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(PHOTO)))
+        self.send_header('ETag', UPSTREAM_ETAG)
+        self.end_headers()
+        self.wfile.write(PHOTO)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    Upstream.requests = []
+    Upstream.delay = None
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Upstream)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def cache(app, tmp_path):
+    import server
+    return server.ImageCache(str(tmp_path), max_bytes=1024 * 1024, revalidate_seconds=3600, timeout=5)
+
+
+def test_miss_then_hit(cache, upstream):
+    path, meta = cache.get(1, f"{upstream}/1.jpg")
+    assert open(path, "rb").read() == PHOTO
+    assert meta['digest'] == hashlib.sha256(PHOTO).hexdigest()[:32]
+
+    path, meta = cache.get(1)
+    assert len(Upstream.requests) == 1
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_stale_entry_is_revalidated(cache, upstream):
+    cache.revalidate_seconds = 0
+    cache.get(1, f"{upstream}/1.jpg")
+    path, meta = cache.get(1)
+
+    assert Upstream.requests[-1] == ("/1.jpg", UPSTREAM_ETAG)
+    assert cache.stats()['revalidations'] == 1
+    assert open(path, "rb").read() == PHOTO
+
+
+def test_concurrent_misses_fetch_once_and_release_their_lock(cache, upstream):
+    Upstream.delay = threading.Event()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(1, f"{upstream}/1.jpg")))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    Upstream.delay.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(Upstream.requests) == 1
+    assert all(path is not None for path, _ in results)
+    assert cache.stats()['hits'] + cache.stats()['misses'] == 8
+    assert cache._fetch_locks == {}
+
+
+def test_failed_fetch_is_not_cached(cache, upstream):
+    assert cache.get(1, f"{upstream}/missing.jpg") == (None, None)
+    assert cache.open_image(1) == (None, None)
+    assert cache._fetch_locks == {}
+
+
+def test_open_image_survives_eviction(cache, upstream):
+    image_file, meta = cache.open_image(1, image_link=f"{upstream}/1.jpg")
+    with image_file:
+        os.remove(cache._path(1, ".img"))
+        os.remove(cache._path(1, ".json"))
+        assert image_file.read() == PHOTO
+
+    # Once evicted, the photo is only found again when the caller has its link
+    assert cache.open_image(1) == (None, None)
+    image_file, meta = cache.open_image(1, image_link=f"{upstream}/1.jpg")
+    with image_file:
+        assert image_file.read() == PHOTO
+    assert len(Upstream.requests) == 2
+
+
+@pytest.fixture
+def route_photo(app, upstream, tmp_path, monkeypatch):
+    import server
+
+    monkeypatch.setattr(server, 'image_cache', server.ImageCache(str(tmp_path), max_bytes=1024 * 1024))
+    with app.app_context():
+        image = server.RouteImage(image_link=f"{upstream}/route.jpg")
+        server.db.session.add(image)
+        server.db.session.commit()
+        image_id = image.id
+    yield image_id
+    with app.app_context():
+        server.db.session.delete(server.db.session.get(server.RouteImage, image_id))
+        server.db.session.commit()
+
+
+def test_image_route_serves_and_validates(client, route_photo):
+    response = client.get(f"/img/{route_photo}")
+    assert response.status_code == 200
+    assert response.data == PHOTO
+    assert response.headers['Content-Type'] == 'image/jpeg'
+    etag = response.headers['ETag']
+    assert etag == UPSTREAM_ETAG
+
+    response = client.get(f"/img/{route_photo}", headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert len(Upstream.requests) == 1
+
+
+def test_image_route_refetches_after_eviction(client, route_photo):
+    import server
+
+    client.get(f"/img/{route_photo}")
+    os.remove(server.image_cache._path(route_photo, ".img"))
+    os.remove(server.image_cache._path(route_photo, ".json"))
+
+    response = client.get(f"/img/{route_photo}")
+    assert response.status_code == 200
+    assert response.data == PHOTO
+    assert len(Upstream.requests) == 2
+
+
+def test_image_route_unknown_image(client, route_photo):
+    assert client.get("/img/999999").status_code == 404
@@ -0,0 +1,138 @@
+import random
+import time
+
+import pytest
+
+import llm
+
+STUB_AREA = 9001       # one route, nothing stored
+FALLBACK_AREA = 9002   # a route with a stored round, and one without
+EMPTY_AREA = 9003      # a route with nothing stored and no fallback
+
+
+def sse_events(body):
+    """The data of each event in a text/event-stream body, comments dropped"""
+    events = []
+    for block in body.decode().split("\n\n"):
+        lines = [line[len("data: "):] for line in block.split("\n") if line.startswith("data: ")]
+        if lines:
+            events.append("\n".join(lines))
+    return events
+
+
+def add_route(server, route_id, area_id):
+    server.db.session.add(server.MpDescriptions(id=route_id, route_id=route_id, route_name=f"Route {route_id}",
+                                                area_id=area_id))
+    server.db.session.add(server.RoutePromptContext(route_id=route_id, description="A crack.", comment_digest="",
+                                                    comments_used=0, prompt=f"Route {route_id}: a crack.",
+                                                    prompt_tokens=5))
+
+
+@pytest.fixture(scope="module")
+def routes(app):
+    import server
+
+    with app.app_context():
+        add_route(server, 900101, STUB_AREA)
+        add_route(server, 900201, FALLBACK_AREA)
+        add_route(server, 900202, FALLBACK_AREA)
+        add_route(server, 900301, EMPTY_AREA)
+        stored = server.LLMDescriptions(route_id=900201, description="A stored description of a crack.",
+                                        hint="A stored hint.", is_daily=False)
+        server.db.session.add(stored)
+        server.db.session.commit()
+        return {'stored_round': stored.id}
+
+
+@pytest.fixture
+def provider(app, monkeypatch):
+    """A fast stub behind a breaker, with fresh content state and no background pool"""
+    import server
+
+    stub = llm.StubProvider(first_chunk_delay=0, chunk_delay=0, seed=0,
+                            breaker=llm.CircuitBreaker(failure_threshold=3, reset_seconds=60))
+    monkeypatch.setattr(server, 'llm_provider', stub)
+    monkeypatch.setattr(server, 'legendary_lines_content', server.LegendaryLinesContent(heartbeat_seconds=1))
+    monkeypatch.setattr(server.legendary_lines_pool, 'depth', 0)
+    # The stream picks the area's last route, so FALLBACK_AREA streams the route with nothing stored
+    monkeypatch.setattr(random, 'choice', lambda seq: seq[-1])
+    return stub
+
+
+def wait_for_hint(client, round_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while True:
+        response = client.get(f"/api/ll/hint/{round_id}")
+        if response.status_code != 202 or time.monotonic() > deadline:
+            return response
+        assert response.headers['Retry-After'] == '1'
+        time.sleep(0.05)
+
+
+def test_stream_generates_round_then_hint(client, routes, provider):
+    import server
+
+    events = sse_events(client.get(f"/api/ll/stream/{STUB_AREA}").data)
+
+    assert events[0] == "ROUTE_ID:900101"
+    assert events[1].startswith("ROUND_ID:")
+    assert events[-1] == "[DONE]"
+    description = "".join(events[2:-1])
+    assert description == provider.text_for(server.LL_DESCRIPTION_INSTRUCTION, "Route 900101: a crack.")
+
+    round_id = int(events[1].split(":")[1])
+    response = wait_for_hint(client, round_id)
+    assert response.status_code == 200
+    assert response.get_json()['hint']
+
+    # The stored round is replayed on the next stream without calling the model again
+    calls = provider.total_calls
+    events = sse_events(client.get(f"/api/ll/stream/{STUB_AREA}").data)
+    assert events[1] == f"ROUND_ID:{round_id}"
+    assert "".join(events[2:-1]) == description
+    assert provider.total_calls == calls
+
+
+def test_failed_generation_falls_back_to_stored_round(client, routes, provider):
+    provider.failure_rate = 1.0
+    events = sse_events(client.get(f"/api/ll/stream/{FALLBACK_AREA}").data)
+
+    assert events[0] == "ROUTE_ID:900202"
+    failed_round = int(events[1].split(":")[1])
+    fallback = events.index("ROUTE_ID:900201")
+    assert events[fallback + 1] == f"ROUND_ID:{routes['stored_round']}"
+    assert "".join(events[fallback + 2:-1]) == "A stored description of a crack."
+    assert events[-1] == "[DONE]"
+
+    # The failed round's row is gone, the fallback round's hint is served
+    assert client.get(f"/api/ll/hint/{failed_round}").status_code == 404
+    assert client.get(f"/api/ll/hint/{routes['stored_round']}").get_json()['hint'] == "A stored hint."
+
+
+def test_open_breaker_serves_stored_rounds_without_calling_model(client, routes, provider):
+    for _ in range(provider.breaker.failure_threshold):
+        provider.breaker.record(False)
+
+    events = sse_events(client.get(f"/api/ll/stream/{FALLBACK_AREA}").data)
+    assert events[0] == "ROUTE_ID:900201"
+    assert events[-1] == "[DONE]"
+    assert provider.total_calls == 0
+
+    # With nothing to fall back on the stream ends in an error rather than a reconnect loop
+    assert sse_events(client.get(f"/api/ll/stream/{EMPTY_AREA}").data) == ["[ERROR]"]
+
+
+def test_hint_pending_and_unknown(app, client, routes):
+    import server
+
+    with app.app_context():
+        pending = server.LLMDescriptions(route_id=900301, description="Being written.", hint="", is_daily=False)
+        server.db.session.add(pending)
+        server.db.session.commit()
+        pending_id = pending.id
+
+    response = client.get(f"/api/ll/hint/{pending_id}")
+    assert response.status_code == 202
+    assert response.headers['Retry-After'] == '1'
+    assert client.get("/api/ll/hint/99999999").status_code == 404
+
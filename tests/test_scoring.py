@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+from geopy.distance import geodesic, great_circle
+
+import scoring
+
+# Pairs that are hard for an inverse geodesic solver: identical points, the poles, nearly and exactly
+# antipodal points, and the antimeridian
+HARD_PAIRS = [
+    (0.0, 0.0, 0.0, 0.0),
+    (37.5, -119.5, 37.5, -119.5),
+    (90.0, 0.0, 90.0, 123.0),
+    (90.0, 0.0, -90.0, 0.0),
+    (0.0, 0.0, 0.0, 180.0),
+    (0.0, 0.0, 0.5, 179.7),
+    (10.0, 20.0, -10.0, -160.0),
+    (-33.9, 151.2, 33.9, -28.85),
+    (0.0, 179.5, 0.0, -179.5),
+    (36.1, 179.9, 36.2, -179.9),
+    (89.9, 0.0, 89.9, 180.0),
+    (-33.9, 151.2, 40.7, -74.0),
+    (0.0, 0.0, 1.0, 0.0),
+]
+
+
+def random_pairs(count, seed=0):
+    """Uniform pairs, every tenth moved to near its antipode"""
+    rng = np.random.default_rng(seed)
+    lat1, lat2 = rng.uniform(-90, 90, (2, count))
+    lon1, lon2 = rng.uniform(-180, 180, (2, count))
+    near = lat1[::10].size
+    lat2[::10] = np.clip(-lat1[::10] + rng.normal(0, 0.2, near), -90, 90)
+    lon2[::10] = (lon1[::10] + 360 + rng.normal(0, 0.2, near)) % 360 - 180
+    return lat1, lon1, lat2, lon2
+
+
+@pytest.mark.parametrize("pair", HARD_PAIRS)
+def test_vincenty_matches_geodesic(pair):
+    lat1, lon1, lat2, lon2 = pair
+    expected = geodesic((lat1, lon1), (lat2, lon2)).km
+    assert float(scoring.vincenty_km(*pair)) == pytest.approx(expected, abs=1e-6)
+
+
+@pytest.mark.parametrize("pair", HARD_PAIRS)
+def test_haversine_matches_great_circle(pair):
+    lat1, lon1, lat2, lon2 = pair
+    expected = great_circle((lat1, lon1), (lat2, lon2)).km
+    # geopy's mean radius is 6371.009 km against our 6371.0088
+    assert float(scoring.haversine_km(*pair)) == pytest.approx(expected, rel=1e-7, abs=1e-9)
+
+
+def test_identical_points_are_zero():
+    lat = np.array([0.0, 37.5, 90.0, -90.0, -33.9])
+    lon = np.array([0.0, -119.5, 123.0, 0.0, 151.2])
+    assert np.all(scoring.vincenty_km(lat, lon, lat, lon) == 0)
+    assert np.allclose(scoring.haversine_km(lat, lon, lat, lon), 0, atol=1e-9)
+
+
+def test_random_pairs_match_geodesic():
+    lat1, lon1, lat2, lon2 = random_pairs(2000)
+    expected = np.array([geodesic((a, b), (c, d)).km for a, b, c, d in zip(lat1, lon1, lat2, lon2)])
+    assert np.max(np.abs(scoring.vincenty_km(lat1, lon1, lat2, lon2) - expected)) < 1e-6
+
+
+def test_haversine_within_stated_error_of_geodesic():
+    lat1, lon1, lat2, lon2 = random_pairs(2000, seed=1)
+    expected = np.array([geodesic((a, b), (c, d)).km for a, b, c, d in zip(lat1, lon1, lat2, lon2)])
+    relative = np.abs(scoring.haversine_km(lat1, lon1, lat2, lon2) - expected) / expected
+    assert np.max(relative) <= 0.0057
+
+
+def test_array_shapes_broadcast():
+    distances = scoring.vincenty_km(np.zeros((2, 3)), 0.0, 1.0, 0.0)
+    assert distances.shape == (2, 3)
+    assert np.allclose(distances, geodesic((0, 0), (1, 0)).km)
+
+
+def test_daily_score_curve():
+    scores = scoring.score_daily([0.0, 0.001, 30.0, 20000.0])
+    assert scores[0] == scoring.MAX_SCORE
+    assert scores[1] == scoring.MAX_SCORE
+    assert scores[2] == pytest.approx(scoring.MAX_SCORE * np.exp(-1))
+    assert scores[3] < 1